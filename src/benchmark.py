@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import TYPE_CHECKING, Callable, Iterator, TypedDict, get_type_hints
+
+import numpy as np
+
+from .core.cf import (
+    indexed_desc_similarity,
+    indexed_support,
+    similarity_matrix,
+    support_matrix,
+)
+from .core.cf.funcs.similarity_func import (
+    adjusted_cosine_similarity,
+    average_difference_matrix,
+    cosine_similarity,
+    pearson_correlation,
+)
+from .io import aggregate_cross_validation, read_entries
+from .io.read_data import TRAIN_FNAME
+from .io.synthetic import SyntheticRatings
+from .predictors import item_based_cf, slope_one_cf, user_based_cf
+from .presets import presets
+
+if TYPE_CHECKING:
+    from .typing import EntryArray, Questions, UserItemRatings
+
+# Grids of (users, items, density) of the synthetic datasets.
+BENCHMARK_GRIDS: dict[str, list[tuple[int, int, float]]] = {
+    'small': [(200, 1000, 0.05)],
+    'default': [(users, items, density) for users in (200, 1000)
+                for items in (500, 1000) for density in (0.02, 0.1)],
+}
+BENCHMARK_BASELINE = 'models/benchmark/baseline.json'
+# Relative slowdown (or peak memory growth) over the baseline reported as a
+# regression.
+REGRESSION_TOLERANCE = 0.25
+# Share of the rating entries held out as questions.
+_TEST_SIZE = 0.05
+
+
+class BenchmarkResult(TypedDict):
+    name: str
+    dataset: str
+    users: int
+    items: int
+    density: float
+    seconds: float
+    peak_bytes: int
+
+
+def _split(entries: EntryArray, seed: int = 0) -> tuple[EntryArray, EntryArray]:
+    # Like read_split_entries, but with its own random state. Test users must
+    # also have training ratings.
+    entries = np.random.default_rng(seed).permutation(entries)
+    bound = int(len(entries) * _TEST_SIZE)
+    train, test = entries[bound:], entries[:bound]
+    return train, test[np.isin(test[:, 0], train[:, 0])]
+
+
+def datasets(
+    grid: list[tuple[int, int, float]],
+    bundled: bool = True
+) -> Iterator[tuple[str, UserItemRatings, UserItemRatings, Questions]]:
+    '''
+    Cross-validation datasets (name, ratings, active ratings, questions): the
+    synthetic ones of the grid (see SyntheticRatings), then the bundled
+    training data.
+    '''
+    for users, items, density in grid:
+        yield (f'synthetic-{users}x{items}@{density}',
+               *aggregate_cross_validation(
+                   *_split(SyntheticRatings(users, items, density).entries())))
+    if bundled:
+        yield ('bundled', *aggregate_cross_validation(
+            *_split(np.array(read_entries(TRAIN_FNAME)))))
+
+
+def measure(func: Callable[[], object], repeat: int = 3) -> tuple[float, int]:
+    '''
+    Best wall time of func over repeat runs, and its peak memory allocated
+    through Python and NumPy (traced in an extra run, as tracing slows it down).
+    '''
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak_bytes
+
+
+def benchmark_cases(r: UserItemRatings, a: UserItemRatings,
+                    q: Questions) -> Iterator[tuple[str, Callable[[], object]]]:
+    '''
+    Named benchmarks of a dataset: the similarity functions, support_matrix,
+    indexed_desc_similarity and the predictors.
+    '''
+    user_sims = {
+        'cosine_similarity': cosine_similarity,
+        'pearson_correlation': pearson_correlation,
+    }
+    item_sims = {
+        'adjusted_cosine_similarity': adjusted_cosine_similarity,
+        'average_difference_matrix': average_difference_matrix,
+    }
+    for name, func in user_sims.items():
+        yield name, lambda func=func: similarity_matrix(a.raw, r.raw, func, 0)
+    for name, func in item_sims.items():
+        yield name, lambda func=func: similarity_matrix(r.raw.T, r.raw.T, func,
+                                                        0)
+    yield 'support_matrix', lambda: support_matrix(r.raw.T, r.raw.T)
+
+    user_similarity = similarity_matrix(a.raw, r.raw, cosine_similarity, 0)
+
+    def desc_similarities() -> None:
+        indexed_desc_similarity.cache_clear()    # type: ignore
+        for row in range(user_similarity.raw.shape[0]):
+            indexed_desc_similarity(row, user_similarity)
+
+    yield 'indexed_desc_similarity', desc_similarities
+
+    # Predictors are timed from precomputed similarities, without the caches of
+    # earlier runs.
+    user_conf = presets['cos'] + {'knn_k': 10}
+    item_conf = presets['adj_cos'] + presets['item_based_k']
+    item_similarity = similarity_matrix(r.raw.T, r.raw.T, item_conf.sim_scheme,
+                                        0)
+    slope_conf = presets['slope_one']
+    item_diff = similarity_matrix(r.raw.T, r.raw.T, slope_conf.sim_scheme, 0)
+    item_diff_sup = support_matrix(r.raw.T, r.raw.T)
+
+    def predict_user_based() -> None:
+        indexed_desc_similarity.cache_clear()    # type: ignore
+        user_based_cf(r, a, q, user_conf, user_similarity=user_similarity)
+
+    def predict_item_based() -> None:
+        indexed_desc_similarity.cache_clear()    # type: ignore
+        item_based_cf(r, a, q, item_conf, item_similarity=item_similarity)
+
+    def predict_slope_one() -> None:
+        indexed_support.cache_clear()    # type: ignore
+        slope_one_cf(r,
+                     a,
+                     q,
+                     slope_conf,
+                     item_diff=item_diff,
+                     item_diff_sup=item_diff_sup)
+
+    yield 'user_based_cf', predict_user_based
+    yield 'item_based_cf', predict_item_based
+    yield 'slope_one_cf', predict_slope_one
+
+
+def run_benchmarks(grid: list[tuple[int, int, float]],
+                   bundled: bool = True,
+                   repeat: int = 3,
+                   verbosity: int = 1) -> list[BenchmarkResult]:
+    results: list[BenchmarkResult] = []
+    for dataset, r, a, q in datasets(grid, bundled):
+        users, items = r.raw.shape
+        density = round(float(np.ma.count(r.raw)) / r.raw.size, 4)
+        for name, func in benchmark_cases(r, a, q):
+            seconds, peak_bytes = measure(func, repeat)
+            results.append({
+                'name': name,
+                'dataset': dataset,
+                'users': users,
+                'items': items,
+                'density': density,
+                'seconds': seconds,
+                'peak_bytes': peak_bytes
+            })
+            if verbosity != 0:
+                print(f'{dataset:<28} {name:<28} {seconds:9.4f}s ' +
+                      f'{peak_bytes / 2**20:9.1f} MiB')
+    return results
+
+
+def write_results(fname: str, results: list[BenchmarkResult]) -> None:
+    '''
+    Write results as CSV if fname ends with .csv, and as JSON otherwise.
+    '''
+    with open(fname, 'w', newline='') as f:
+        if fname.endswith('.csv'):
+            writer = csv.DictWriter(f,
+                                    fieldnames=BenchmarkResult.__annotations__)
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump(results, f, indent=2)
+
+
+def read_results(fname: str) -> list[BenchmarkResult]:
+    '''
+    Read results written by write_results, as CSV if fname ends with .csv and
+    as JSON otherwise.
+    '''
+    with open(fname, newline='') as f:
+        if not fname.endswith('.csv'):
+            return json.load(f)
+        # CSV fields are strings, converted back to the types of the fields.
+        types = get_type_hints(BenchmarkResult)
+        return [{name: types[name](value)
+                 for name, value in row.items()}
+                for row in csv.DictReader(f)]    # type: ignore
+
+
+def compare_results(results: list[BenchmarkResult],
+                    baseline: list[BenchmarkResult],
+                    tolerance: float = REGRESSION_TOLERANCE) -> list[str]:
+    '''
+    Regressions of results over baseline: the benchmarks of a dataset that are
+    slower, or take more peak memory, by more than tolerance (relative).
+    '''
+    base = {(result['dataset'], result['name']): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result['dataset'], result['name'])
+        if key not in base:
+            continue
+        for field in ('seconds', 'peak_bytes'):
+            ratio = result[field] / max(base[key][field],
+                                        1e-9)    # type: ignore
+            if ratio > 1 + tolerance:
+                regressions.append(f'{key[0]} {key[1]}: {field} ' +
+                                   f'{base[key][field]} -> {result[field]} ' +
+                                   f'(x{ratio:.2f})')
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the similarity builders and the predictors.')
+    parser.add_argument('--grid', choices=BENCHMARK_GRIDS, default='small')
+    parser.add_argument('--no-bundled',
+                        action='store_true',
+                        help='skip the bundled training data')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='results file (.json or .csv)')
+    parser.add_argument('--baseline',
+                        nargs='?',
+                        const=BENCHMARK_BASELINE,
+                        help='compare with the results of a baseline file')
+    parser.add_argument('--save-baseline',
+                        nargs='?',
+                        const=BENCHMARK_BASELINE,
+                        help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(BENCHMARK_GRIDS[args.grid], not args.no_bundled,
+                             args.repeat)
+    if args.output:
+        write_results(args.output, results)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or '.', exist_ok=True)
+        write_results(args.save_baseline, results)
+
+    if args.baseline:
+        regressions = compare_results(results, read_results(args.baseline),
+                                      args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,17 @@
-from .similarity import similarity_matrix, support_matrix
+from .lsh import ProjectionIndex, graph_recall
+from .similarity import (
+    approximate_knn_graph,
+    difference_support_matrix,
+    knn_graph,
+    parallel_similarity_matrix,
+    similarity_matrix,
+    support_matrix,
+)
 from .similarity_selection import indexed_desc_similarity, indexed_support
 
 __all__ = [
-    'similarity_matrix', 'support_matrix', 'indexed_desc_similarity',
+    'similarity_matrix', 'parallel_similarity_matrix', 'support_matrix',
+    'difference_support_matrix', 'knn_graph', 'approximate_knn_graph',
+    'ProjectionIndex', 'graph_recall', 'indexed_desc_similarity',
     'indexed_support'
 ]
@@ -4,13 +4,29 @@ from typing import TYPE_CHECKING
 
 import numpy as np
 
-from ..prediction import prediction_func
+from ..prediction import batched, prediction_func
 
 if TYPE_CHECKING:
-    from ....typing import IntMaskedArray, RatingMatrix
+    from ....typing import (
+        FloatArray,
+        FloatMatrix,
+        IntArray,
+        IntMaskedArray,
+        IntMatrix,
+        NeighborTerms,
+        RatingMatrix,
+    )
     from ..prediction import PredictionGenerator
 
 
+def _weighted_average_terms(_rows: IntMatrix, weights: FloatMatrix,
+                            values: FloatMatrix, _active_rows: IntArray,
+                            _active_users: RatingMatrix,
+                            _row_means: FloatArray) -> NeighborTerms:
+    return values * weights, weights, 0
+
+
+@batched(_weighted_average_terms)
 @prediction_func
 def weighted_average(col: int, _active_row: int, r: RatingMatrix,
                      _active_user: IntMaskedArray) -> PredictionGenerator:
@@ -29,6 +45,15 @@ def weighted_average(col: int, _active_row: int, r: RatingMatrix,
             res = total / total_weight
 
 
+def _diff_weighted_average_terms(rows: IntMatrix, weights: FloatMatrix,
+                                 values: FloatMatrix, active_rows: IntArray,
+                                 _active_users: RatingMatrix,
+                                 row_means: FloatArray) -> NeighborTerms:
+    return ((values - row_means[rows]) * weights, np.abs(weights),
+            row_means[active_rows])
+
+
+@batched(_diff_weighted_average_terms)
 @prediction_func
 def diff_weighted_average(col: int, active_row: int, r: RatingMatrix,
                           _active_user: IntMaskedArray) -> PredictionGenerator:
@@ -47,6 +72,17 @@ def diff_weighted_average(col: int, active_row: int, r: RatingMatrix,
             res = total / total_weight + np.ma.mean(r[active_row])
 
 
+def _adj_diff_weighted_average_terms(_rows: IntMatrix, weights: FloatMatrix,
+                                     values: FloatMatrix,
+                                     _active_rows: IntArray,
+                                     active_users: RatingMatrix,
+                                     _row_means: FloatArray) -> NeighborTerms:
+    user_means = np.ma.filled(np.ma.mean(active_users, axis=1), np.nan)
+    return ((values - user_means[:, None]) * weights, np.abs(weights),
+            user_means)
+
+
+@batched(_adj_diff_weighted_average_terms)
 @prediction_func
 def adj_diff_weighted_average(
         col: int, _active_row: int, r: RatingMatrix,
@@ -66,6 +102,18 @@ def adj_diff_weighted_average(
             res = total / total_weight + np.ma.mean(active_user)
 
 
+def _slope_one_weighted_average_terms(rows: IntMatrix, weights: FloatMatrix,
+                                      _values: FloatMatrix,
+                                      _active_rows: IntArray,
+                                      active_users: RatingMatrix,
+                                      _row_means: FloatArray) -> NeighborTerms:
+    user_values = np.take_along_axis(np.ma.filled(active_users, 0),
+                                     rows,
+                                     axis=1)
+    return user_values * weights, weights, 0
+
+
+@batched(_slope_one_weighted_average_terms)
 @prediction_func
 def slope_one_weighted_average(
         _col: int, _active_row: int, _r: RatingMatrix,
@@ -1,87 +1,214 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Callable, Literal, TypeVar, overload
 
 import numpy as np
 
+from ....typing import float_type
+
 if TYPE_CHECKING:
-    from ....typing import NanSimilarityMatrix, RatingMatrix
+    from ....typing import (
+        FloatMaskedArray,
+        FloatMatrix,
+        IntArray,
+        NanSimilarityMatrix,
+        RatingMatrix,
+        SupportMatrix,
+    )
 
+    # Rows of a block: a slice, or the indices of the rows.
+    BlockRows = slice | IntArray
+    FBlockKwargs = Callable[[RatingMatrix, RatingMatrix],
+                            Callable[[BlockRows, BlockRows], dict[str, Any]]]
 
-def cosine_similarity(r1: RatingMatrix,
-                      r2: RatingMatrix) -> NanSimilarityMatrix:
+FSim = TypeVar('FSim', bound=Callable[..., Any])
+
+
+def blockwise(block_kwargs: FBlockKwargs) -> Callable[[FSim], FSim]:
+    '''
+    Declare the statistics of the whole r1 and r2 that a similarity function
+    needs when it is computed in blocks of rows (see similarity_matrix), as the
+    block_kwargs attribute of the function. block_kwargs(r1, r2) computes them
+    once, and returns the keyword arguments of a block from its rows.
+    '''
+
+    def declare(similarity_func: FSim) -> FSim:
+        similarity_func.block_kwargs = block_kwargs    # type: ignore
+        return similarity_func
+
+    return declare
+
+
+def rated_values(r: RatingMatrix) -> FloatMatrix:
+    '''
+    Dense float copy of a rating matrix with the unrated entries set to 0.
+    '''
+    return np.ma.filled(r, 0).astype(float_type())
+
+
+def rated_indicator(r: RatingMatrix) -> FloatMatrix:
+    '''
+    Dense 0/1 matrix marking the rated entries of a rating matrix.
+    '''
+    return (~np.ma.getmaskarray(r)).astype(float_type())
+
+
+def corated_sum(m1: FloatMatrix, m2: FloatMatrix) -> FloatMatrix:
+    '''
+    m1 · m2.T, the sums over the co-rated columns of every pair of rows.
+    '''
+    return m1 @ m2.T
+
+
+def corated_cosine(r1: RatingMatrix, r2: RatingMatrix) -> NanSimilarityMatrix:
     '''
+    Cosine similarity between rows in r1 and r2, with both the dot product and
+    the norms restricted to the co-rated columns of each pair of rows.
+
+    Every co-rated sum is one matrix product (see corated_sum) of the value
+    matrices V and the indicator matrices I:
+        dot(u, v)     = V1 · V2.T
+        norm_r1(u, v) = V1² · I2.T
+        norm_r2(u, v) = I1 · V2².T
+        count(u, v)   = I1 · I2.T
+    so the memory stays O(u·v + u·i) instead of O(u·v·i).
+
     r1: u x i matrix
     r2: v x i matrix
     return: matrix of size u x v, with similarities between rows in r1 and r2.
     '''
-    dot_m = np.ma.dot(r1, r2.T)
-
-    # Add new axes to enable broadcasting when manually calculating norms of r1
-    # and r2.T with the union mask applied.
-    r1_na = r1[..., None]
-    r2t_na = r2.T[None, ...]
+    v1, v2 = rated_values(r1), rated_values(r2)
+    i1, i2 = rated_indicator(r1), rated_indicator(r2)
 
-    mask_m = r1_na.mask | r2t_na.mask
-    r1_broadcast = np.broadcast_to(r1_na**2, mask_m.shape, subok=True)
-    r2t_broadcast = np.broadcast_to(r2t_na**2, mask_m.shape, subok=True)
+    dot_m = corated_sum(v1, v2)
+    norm_r1 = corated_sum(v1**2, i2)
+    norm_r2 = corated_sum(i1, v2**2)
+    count_m = corated_sum(i1, i2)
 
-    # The broadcasted arrays are ensured to be MaskedArrays since we set the
-    # subok flag, but the type checker has no clue about this.
-    r1_broadcast.mask = mask_m    # type: ignore
-    r2t_broadcast.mask = mask_m    # type: ignore
+    prod_norm = np.sqrt(norm_r1 * norm_r2)
 
     # Note: if the intersection between two rows has length 1, we set sim as 0
     #       to avoid false positive of cosine similarity.
-    #       This is done by setting zero for norm, which results in zero-division
-    #       in res, and fill all the invalid value in res as 0 before returning.
-    norm_r1 = np.apply_along_axis(
-        lambda c: 0 if c.count() == 1 else np.ma.sum(c), 1, r1_broadcast)
-    norm_r2 = np.apply_along_axis(
-        lambda c: 0 if c.count() == 1 else np.ma.sum(c), 1, r2t_broadcast)
+    #       This is done by masking the pair (along with the pairs that have no
+    #       co-rated column or a zero norm), so that the masked values get the
+    #       similarity fill value.
+    mask_m = (count_m <= 1) | (prod_norm == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sim_m = dot_m / prod_norm
+    return np.ma.masked_array(sim_m, mask=mask_m)
 
-    prod_norm = np.ma.sqrt(norm_r1 * norm_r2)
 
-    return dot_m / prod_norm
-
-
-def pearson_correlation(r1: RatingMatrix,
-                        r2: RatingMatrix) -> NanSimilarityMatrix:
+def cosine_similarity(r1: RatingMatrix,
+                      r2: RatingMatrix) -> NanSimilarityMatrix:
+    '''
+    r1: u x i matrix
+    r2: v x i matrix
+    return: matrix of size u x v, with similarities between rows in r1 and r2.
+    '''
+    return corated_cosine(r1, r2)
+
+
+def _row_means(
+        r1: RatingMatrix,
+        r2: RatingMatrix) -> Callable[[BlockRows, BlockRows], dict[str, Any]]:
+    # The mean of a row may round differently in a block of another shape.
+    r1_mean, r2_mean = np.ma.mean(r1, axis=1), np.ma.mean(r2, axis=1)
+    return lambda rows1, rows2: {
+        'r1_mean': r1_mean[rows1],
+        'r2_mean': r2_mean[rows2]
+    }
+
+
+@blockwise(_row_means)
+def pearson_correlation(
+        r1: RatingMatrix,
+        r2: RatingMatrix,
+        r1_mean: FloatMaskedArray | None = None,
+        r2_mean: FloatMaskedArray | None = None) -> NanSimilarityMatrix:
     '''
     r1: u x i matrix
     r2: v x i matrix
+    r1_mean, r2_mean: average ratings of the rows; derived from r1 and r2 when
+        not given.
     return: matrix of size u x v, with similarities between rows in r1 and r2.
     '''
-    r1_mean = np.ma.mean(r1, axis=1)[:, None]
-    r2_mean = np.ma.mean(r2, axis=1)[:, None]
-    return cosine_similarity(r1 - r1_mean, r2 - r2_mean)
+    if r1_mean is None:
+        r1_mean = np.ma.mean(r1, axis=1)
+    if r2_mean is None:
+        r2_mean = np.ma.mean(r2, axis=1)
+    return corated_cosine(r1 - r1_mean[:, None], r2 - r2_mean[:, None])
 
 
-def adjusted_cosine_similarity(r1: RatingMatrix,
-                               r2: RatingMatrix) -> NanSimilarityMatrix:
+def _user_mean(
+        r1: RatingMatrix,
+        r2: RatingMatrix) -> Callable[[BlockRows, BlockRows], dict[str, Any]]:
+    # Blocks of r1 hold only part of the items.
+    user_mean = np.ma.mean(r1, axis=0)
+    return lambda rows1, rows2: {'user_mean': user_mean}
+
+
+@blockwise(_user_mean)
+def adjusted_cosine_similarity(
+        r1: RatingMatrix,
+        r2: RatingMatrix,
+        user_mean: FloatMaskedArray | None = None) -> NanSimilarityMatrix:
     '''
-    The pearson correlation for *item-based CF* only that uses the average rating
-    of the users instead of the items.
+    The pearson correlation for *item-based CF* only that uses the average
+    rating of the users instead of the items.
 
     r1: i x u matrix
     r2: i x u matrix
+    user_mean: average ratings of the users; derived from r1 when not given.
     return: matrix of size i x i, with similarities between rows in r1 and r2.
     '''
     # Note that for item-based CF, r1 and r2 should be same (i.e. the known
     # rating matrix), so they can be applied with the same user mean matrix.
-    user_mean = np.ma.mean(r1, axis=0)
-    return cosine_similarity(r1 - user_mean, r2 - user_mean)
+    if user_mean is None:
+        user_mean = np.ma.mean(r1, axis=0)
+    return corated_cosine(r1 - user_mean, r2 - user_mean)
+
+
+@overload
+def average_difference_matrix(
+        r1: RatingMatrix,
+        r2: RatingMatrix,
+        return_counts: Literal[False] = False) -> NanSimilarityMatrix:
+    ...
 
 
-def average_difference_matrix(r1: RatingMatrix,
-                              r2: RatingMatrix) -> NanSimilarityMatrix:
+@overload
+def average_difference_matrix(
+        r1: RatingMatrix, r2: RatingMatrix, return_counts: Literal[True]
+) -> tuple[NanSimilarityMatrix, SupportMatrix]:
+    ...
+
+
+def average_difference_matrix(
+    r1: RatingMatrix,
+    r2: RatingMatrix,
+    return_counts: bool = False
+) -> NanSimilarityMatrix | tuple[NanSimilarityMatrix, SupportMatrix]:
     '''
     For slope one. Calculate the average difference between columns.
+
+    The average difference of rows u and v is (sum1(u, v) - sum2(u, v)) /
+    count(u, v), where
+        sum1(u, v)  = V1 · I2.T    (sum of u's ratings co-rated with v)
+        sum2(u, v)  = I1 · V2.T    (sum of v's ratings co-rated with u)
+        count(u, v) = I1 · I2.T
+    Pairs without co-rated columns are masked. With return_counts, the counts
+    are returned along with the differences, so that the support matrix does
+    not need to be computed again.
     '''
-    r1_na = r1[..., None]
-    r2t_na = r2.T[None, ...]
+    v1, v2 = rated_values(r1), rated_values(r2)
+    i1, i2 = rated_indicator(r1), rated_indicator(r2)
+
+    diff_sum_m = corated_sum(v1, i2) - corated_sum(i1, v2)
+    count_m = corated_sum(i1, i2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diff_m = np.ma.masked_array(diff_sum_m / count_m, mask=count_m == 0)
 
-    mask_m = r1_na.mask | r2t_na.mask
-    diff_m = r1_na - r2t_na
-    diff_m.mask = mask_m
-    return np.ma.mean(diff_m, axis=1)
+    if return_counts:
+        return diff_m, count_m
+    return diff_m
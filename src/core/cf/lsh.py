@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from ...typing import NpInt
+from .funcs.similarity_func import rated_values
+
+if TYPE_CHECKING:
+    from ...typing import (
+        BoolMatrix,
+        FloatMatrix,
+        IntArray,
+        IntMatrix,
+        NeighborGraph,
+        RatingMatrix,
+    )
+
+# Default number of hash tables. More tables find more of the true neighbors
+# (recall), at the cost of more candidates to re-rank.
+LSH_TABLES = 8
+# Expected number of rows per bucket, from which the number of bits of a hash
+# is derived when not given.
+LSH_BUCKET_SIZE = 16
+
+
+def centered_values(r: RatingMatrix) -> FloatMatrix:
+    '''
+    Dense float copy of a rating matrix with every row centered on its mean
+    rating, and the unrated entries set to 0 (i.e. to the mean).
+    '''
+    return rated_values(r - np.ma.mean(r, axis=1)[:, None])
+
+
+class ProjectionIndex():
+    '''
+    Locality sensitive hash index of the rows of a rating matrix, by signed
+    random projections of their mean-centered ratings (see centered_values).
+
+    Every one of n_tables tables hashes a row to the signs of its projections on
+    n_bits random directions, so two rows share a bucket with a probability that
+    decreases with the angle between them. The candidates of a query are the
+    rows sharing a bucket with it in any table; a query costs O(n_tables *
+    bucket size) rather than O(rows).
+
+    n_tables: recall vs speed knob, see LSH_TABLES.
+    n_bits: bits of a hash, log2(rows / LSH_BUCKET_SIZE) by default.
+    '''
+
+    def __init__(self,
+                 r: RatingMatrix,
+                 n_tables: int = LSH_TABLES,
+                 n_bits: int | None = None,
+                 seed: int = 0) -> None:
+        if n_bits is None:
+            n_bits = int(np.log2(max(2, r.shape[0] // LSH_BUCKET_SIZE)))
+        self.n_tables = n_tables
+        self.n_bits = min(n_bits, 62)
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((r.shape[1], n_tables * self.n_bits))
+
+        # Rows sorted by bucket in every table, so that a bucket is a range.
+        codes = self._codes(self.project(r))
+        self._order: IntMatrix = np.argsort(codes, axis=0,
+                                            kind='stable').astype(NpInt)
+        self._codes_sorted = np.take_along_axis(codes, self._order, axis=0)
+
+    def project(self, r: RatingMatrix) -> BoolMatrix:
+        '''
+        Signs of the projections of the rows of r, n_tables * n_bits per row.
+        '''
+        return centered_values(r) @ self._planes > 0
+
+    def _codes(self, signs: BoolMatrix) -> IntMatrix:
+        bits = signs.reshape(signs.shape[0], self.n_tables, self.n_bits)
+        return bits.astype(
+            np.int64) @ (np.int64(1) << np.arange(self.n_bits, dtype=np.int64))
+
+    def query(self, r: RatingMatrix, opposite: bool = False) -> list[IntArray]:
+        '''
+        Sorted candidate rows of the index for every row of r.
+
+        opposite: also take the rows hashed like the negated query, i.e. the
+            candidates for a strong negative similarity (e.g. Pearson
+            correlation sorted by absolute value).
+        '''
+        signs = self.project(r)
+        probes = [self._codes(signs)]
+        if opposite:
+            probes.append(self._codes(~signs))
+
+        # Bucket range of every query in every table.
+        ranges = []
+        for codes in probes:
+            for t in range(self.n_tables):
+                column = self._codes_sorted[:, t]
+                ranges.append(
+                    (t, np.searchsorted(column, codes[:, t], side='left'),
+                     np.searchsorted(column, codes[:, t], side='right')))
+
+        return [
+            np.unique(
+                np.concatenate(
+                    [self._order[lo[i]:hi[i], t]
+                     for t, lo, hi in ranges]))
+            for i in range(r.shape[0])
+        ]
+
+
+def graph_recall(graph: NeighborGraph, exact_graph: NeighborGraph,
+                 k: int) -> float:
+    '''
+    Fraction of the top k neighbors of every row in exact_graph that graph (an
+    approximate KNN graph, see approximate_knn_graph) found.
+    '''
+    found = total = 0
+    for neighbors, exact in zip(graph.neighbors, exact_graph.neighbors[:, :k]):
+        exact = exact[exact >= 0]
+        found += np.count_nonzero(np.isin(exact, neighbors))
+        total += len(exact)
+    return found / total if total else 1.0
@@ -2,12 +2,43 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, Callable, Generator
 
+import numpy as np
+
+from ...typing import (
+    NpFloat,
+    NpInt,
+    float_array,
+    float_matrix,
+    float_type,
+    int_array,
+)
+from ..shared.parallel import chunk_map
+
 if TYPE_CHECKING:
-    from ...typing import FPrediction, IndexedSimArray, IntMaskedArray, RatingMatrix
+    from ...typing import (
+        BoolMatrix,
+        FDynamicK,
+        FloatArray,
+        FloatMatrix,
+        FNeighborTerms,
+        FPrediction,
+        IndexedSimArray,
+        IntArray,
+        IntMaskedArray,
+        IntMatrix,
+        NeighborTerms,
+        PredictionArray,
+        RatingMatrix,
+        StackedMatrix,
+    )
 
 Accessor = Callable[[], float]
 PredictionGenerator = Generator[Accessor, tuple[float, int], None]
 
+# Questions predicted together by batch_predict; bounds the questions x
+# neighbors arrays of a batch.
+BATCH_SIZE = 512
+
 
 def prediction_func(
         build_generator: Callable[[int, int, RatingMatrix, IntMaskedArray],
@@ -24,7 +55,7 @@ def prediction_func(
                 break
 
             row = int(i_row)
-            if r.mask[row, col]:
+            if r[row, col] is np.ma.masked:
                 # No value
                 continue
 
@@ -40,5 +71,206 @@ def prediction_func(
 
     # Restore function name from the generator builder.
     wrapped.__name__ = build_generator.__name__
+    wrapped.filter_by_weight = filter_by_weight    # type: ignore
 
     return wrapped
+
+
+def batched(
+        neighbor_terms: FNeighborTerms) -> Callable[[FPrediction], FPrediction]:
+    '''
+    Attach the vectorized form of a prediction function, so that predictors can
+    answer all the questions at once with batch_predict.
+
+    neighbor_terms gives, for a batch of questions and their ordered neighbors,
+    the numerator and denominator terms of every neighbor and the offset of
+    every question. The prediction of a question is then
+        sum(numerator) / sum(denominator) + offset
+    over the neighbors the per-question protocol would have sent to the
+    generator, or 0 if the denominator sums to 0.
+    '''
+
+    def decorate(prediction: FPrediction) -> FPrediction:
+        prediction.neighbor_terms = neighbor_terms    # type: ignore
+        return prediction
+
+    return decorate
+
+
+def is_batched(prediction: FPrediction) -> bool:
+    return getattr(prediction, 'neighbor_terms', None) is not None
+
+
+def question_ks(knn_k: int | FDynamicK, user_inds: IntArray,
+                r: RatingMatrix | StackedMatrix) -> IntArray:
+    '''
+    k of every question, with dynamic k evaluated once per active user.
+    '''
+    if not callable(knn_k):
+        return np.full(len(user_inds), knn_k, dtype=NpInt)
+
+    unique_inds, inverse = np.unique(user_inds, return_inverse=True)
+    return int_array([knn_k(r[ind]) for ind in unique_inds])[inverse]
+
+
+def select_neighbors(
+        ks: IntArray,
+        rated: BoolMatrix,
+        weights: FloatMatrix,
+        filter_by_weight: Callable[[float], bool] | None = None) -> BoolMatrix:
+    '''
+    Mask of the ordered neighbors that the per-question protocol takes: the
+    first k rated ones (all of them when k is negative) before the first rated
+    neighbor whose weight is filtered out.
+    '''
+    if filter_by_weight is not None:
+        stop = rated & np.vectorize(filter_by_weight, otypes=[bool])(weights)
+    else:
+        stop = rated & (weights == 0)
+
+    valid = rated & (np.cumsum(stop, axis=1) == 0)
+    rank = np.cumsum(valid, axis=1)
+    return valid & ((rank <= ks[:, None]) | (ks[:, None] < 0))
+
+
+def _neighbor_terms(prediction: FPrediction, cols: IntArray,
+                    active_rows: IntArray, active_users: RatingMatrix,
+                    r: RatingMatrix | StackedMatrix, row_means: FloatArray,
+                    rows: IntMatrix,
+                    weights: FloatMatrix) -> tuple[BoolMatrix, NeighborTerms]:
+    '''
+    Mask of the neighbors that have a value in the question's column, and the
+    neighbor terms of the prediction function (see batched).
+    '''
+    padding = rows < 0
+    rows = np.where(padding, 0, rows)
+    values = r[rows, cols[:, None]]
+    rated = ~np.ma.getmaskarray(values) & ~padding
+
+    return rated, prediction.neighbor_terms(    # type: ignore
+        rows, weights,
+        np.ma.filled(values, 0).astype(float_type()), active_rows, active_users,
+        row_means)
+
+
+def predict_neighbors(prediction: FPrediction, ks: IntArray, cols: IntArray,
+                      active_rows: IntArray, active_users: RatingMatrix,
+                      r: RatingMatrix | StackedMatrix, row_means: FloatArray,
+                      rows: IntMatrix, weights: FloatMatrix) -> PredictionArray:
+    '''
+    Vectorized prediction of a batch of questions.
+
+    ks, cols, active_rows: one entry per question.
+    active_users: one active user row per question.
+    rows, weights: ordered neighbor rows of r and their weights, one row per
+        question. Negative neighbor rows are padding.
+    '''
+    rated, (numerators, denominators,
+            offsets) = _neighbor_terms(prediction, cols, active_rows,
+                                       active_users, r, row_means, rows,
+                                       weights)
+    taken = select_neighbors(ks, rated, weights,
+                             getattr(prediction, 'filter_by_weight', None))
+
+    # Accumulated in NpFloat whatever the precision of the terms.
+    total = np.sum(numerators, axis=1, where=taken, dtype=NpFloat)
+    total_weight = np.sum(denominators, axis=1, where=taken, dtype=NpFloat)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = total / total_weight + offsets
+    return np.where(total_weight != 0, res, 0)
+
+
+def sweep_neighbors(prediction: FPrediction, k_range: IntArray, cols: IntArray,
+                    active_rows: IntArray, active_users: RatingMatrix,
+                    r: RatingMatrix | StackedMatrix, row_means: FloatArray,
+                    rows: IntMatrix, weights: FloatMatrix) -> FloatMatrix:
+    '''
+    predict_neighbors for every k of k_range at once. The neighbors taken for k
+    are a prefix of those taken for a larger k, so a single pass of cumulative
+    sums over neighbors ordered for the largest k gives all the predictions.
+    Returns a (len(k_range), questions) matrix.
+    '''
+    rated, (numerators, denominators,
+            offsets) = _neighbor_terms(prediction, cols, active_rows,
+                                       active_users, r, row_means, rows,
+                                       weights)
+    valid = select_neighbors(np.full(len(cols), -1, dtype=NpInt), rated,
+                             weights,
+                             getattr(prediction, 'filter_by_weight', None))
+
+    # Prefix sums, with a leading 0 for taking no neighbor.
+    zeros = np.zeros((len(cols), 1))
+    cum_total = np.hstack(
+        (zeros, np.cumsum(np.where(valid, numerators, 0), axis=1,
+                          dtype=NpFloat)))
+    cum_weight = np.hstack((zeros,
+                            np.cumsum(np.where(valid, denominators, 0),
+                                      axis=1,
+                                      dtype=NpFloat)))
+
+    # Length of the prefix of neighbors taken for every k and question.
+    rank = np.cumsum(valid, axis=1)
+    prefix = np.sum(rank[None, :, :] <= k_range[:, None, None], axis=2)
+    questions = np.arange(len(cols))
+    total = cum_total[questions, prefix]
+    total_weight = cum_weight[questions, prefix]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = total / total_weight + offsets
+    return np.where(total_weight != 0, res, 0)
+
+
+def batch_predict(prediction: FPrediction,
+                  ks: IntArray,
+                  cols: IntArray,
+                  active_rows: IntArray,
+                  r: RatingMatrix | StackedMatrix,
+                  active_users: Callable[[slice], RatingMatrix],
+                  neighbors: Callable[[slice], tuple[IntMatrix, FloatMatrix]],
+                  batch_size: int = BATCH_SIZE,
+                  workers: int | None = 1) -> PredictionArray:
+    '''
+    Predict all the questions, batch_size questions at a time. active_users and
+    neighbors build the active user rows and the ordered neighbors of the
+    questions in a slice (see predict_neighbors). Batches are predicted by
+    workers threads, one per core if None (see chunk_map).
+    '''
+    predictions = float_array(len(cols))
+    row_means = np.ma.filled(r.mean(axis=1), np.nan).astype(float_type())
+
+    def predict_batch(batch: slice) -> None:
+        rows, weights = neighbors(batch)
+        predictions[batch] = predict_neighbors(prediction, ks[batch],
+                                               cols[batch], active_rows[batch],
+                                               active_users(batch), r,
+                                               row_means, rows, weights)
+
+    chunk_map(predict_batch, len(cols), batch_size, workers)
+    return predictions
+
+
+def batch_sweep(prediction: FPrediction,
+                k_range: IntArray,
+                cols: IntArray,
+                active_rows: IntArray,
+                r: RatingMatrix | StackedMatrix,
+                active_users: Callable[[slice], RatingMatrix],
+                neighbors: Callable[[slice], tuple[IntMatrix, FloatMatrix]],
+                batch_size: int = BATCH_SIZE,
+                workers: int | None = 1) -> FloatMatrix:
+    '''
+    batch_predict for every k of k_range at once (see sweep_neighbors), where
+    neighbors gives the ordered neighbors for the largest k. Returns a
+    (len(k_range), questions) matrix.
+    '''
+    predictions = float_matrix((len(k_range), len(cols)))
+    row_means = np.ma.filled(r.mean(axis=1), np.nan).astype(float_type())
+
+    def sweep_batch(batch: slice) -> None:
+        rows, weights = neighbors(batch)
+        predictions[:, batch] = sweep_neighbors(prediction, k_range,
+                                                cols[batch], active_rows[batch],
+                                                active_users(batch), r,
+                                                row_means, rows, weights)
+
+    chunk_map(sweep_batch, len(cols), batch_size, workers)
+    return predictions
@@ -1,39 +1,319 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import mmap
+import os
+from math import isqrt
+from typing import TYPE_CHECKING, Any, Callable
 
 import numpy as np
 
-from ...typing import NpFloat, Similarity, Support
+from ...typing import (
+    NeighborGraph,
+    NpCompactFloat,
+    NpInt,
+    Similarity,
+    Support,
+    float_matrix,
+    float_type,
+    int_matrix,
+)
+from ..shared.parallel import parallel_map
+from .funcs.similarity_func import average_difference_matrix, rated_indicator
+from .lsh import LSH_TABLES, ProjectionIndex
+from .similarity_selection import prune_neighbors
 
 if TYPE_CHECKING:
-    from ...typing import FloatMatrix, FSimilarity, RatingMatrix
+    from ...typing import (
+        FloatMatrix,
+        FPreSortSim,
+        FSimilarity,
+        IntMatrix,
+        RatingMatrix,
+    )
 
+# Number of float copies of the input rows and of the output pairs a similarity
+# function keeps alive while computing one block (values, indicators, squares,
+# dot products, norms, counts...). Used to turn a memory budget into a block
+# size.
+_ROW_COPIES = 6
+_PAIR_COPIES = 8
 
-def similarity_matrix(
+# Largest difference of a similarity computed in blocks to the whole matrix at
+# once, in units in the last place of the largest similarity. Blocks are given
+# the statistics of the whole matrices (see blockwise), but BLAS sums matrix
+# products of other shapes in other orders, which rounds non-integer values
+# (centered or weighted ratings) differently. Exact ties may then break apart.
+BLOCK_ULPS = 16
+
+# Default working memory of one block of rows of a KNN graph (see knn_graph).
+KNN_GRAPH_MAX_BYTES = 1 << 26
+
+# Working memory of one block of bit-packed co-rating counts.
+_PACKED_BLOCK_BYTES = 1 << 26
+
+# Number of set bits of every byte value.
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def similarity_matrix(r1: RatingMatrix,
+                      r2: RatingMatrix,
+                      similarity_func: FSimilarity,
+                      fill_value: int,
+                      weights: tuple[FloatMatrix, FloatMatrix] | None = None,
+                      max_bytes: int | None = None) -> Similarity:
+    '''
+    Compute the similarities between rows in r1 and r2. When max_bytes is set,
+    the rows are split into blocks that each fit in about max_bytes of working
+    memory, and the blocks are written into a preallocated output. Blocks may
+    differ from the whole matrix by BLOCK_ULPS.
+    '''
+    if weights is not None:
+        weight1, weight2 = weights
+        r1, r2 = r1 * weight1, r2 * weight2
+
+    if max_bytes is None:
+        return Similarity(similarity_func(r1, r2).filled(fill_value))
+
+    sim_m = float_matrix((r1.shape[0], r2.shape[0]))
+    block_kwargs = _block_kwargs(similarity_func, r1, r2)
+    for rows1, rows2 in similarity_blocks(r1.shape[0], r2.shape[0], r1.shape[1],
+                                          max_bytes):
+        kwargs = block_kwargs(rows1, rows2)
+        sim_m[rows1, rows2] = similarity_func(r1[rows1], r2[rows2],
+                                              **kwargs).filled(fill_value)
+    return Similarity(sim_m)
+
+
+def parallel_similarity_matrix(r1: RatingMatrix,
+                               r2: RatingMatrix,
+                               similarity_func: FSimilarity,
+                               fill_value: int,
+                               weights: tuple[FloatMatrix, FloatMatrix] |
+                               None = None,
+                               workers: int | None = None,
+                               max_bytes: int | None = None) -> Similarity:
+    '''
+    Same as similarity_matrix, but the row blocks are computed by a pool of
+    workers (one per core by default). The workers write their blocks straight
+    into a shared memory output, so no block is sent back to the caller.
+
+    Workers are forked processes on Linux, and threads elsewhere (see
+    parallel_map). max_bytes bounds the working memory of each worker. Like the
+    blocks of similarity_matrix, the result may differ from the serial one by
+    BLOCK_ULPS.
+    '''
+    if weights is not None:
+        weight1, weight2 = weights
+        r1, r2 = r1 * weight1, r2 * weight2
+
+    workers = workers or os.cpu_count() or 1
+    n1, n2 = r1.shape[0], r2.shape[0]
+    if max_bytes is not None:
+        blocks = similarity_blocks(n1, n2, r1.shape[1], max_bytes)
+    else:
+        # A few blocks per worker to even out the load.
+        size = max(1, -(-n1 // (workers * 4)))
+        blocks = [(slice(i, min(i + size, n1)), slice(0, n2))
+                  for i in range(0, n1, size)]
+
+    # Anonymous shared mapping: written by forked workers, and visible to this
+    # process without any copy.
+    dtype = np.dtype(float_type())
+    buffer = mmap.mmap(-1, max(1, n1 * n2 * dtype.itemsize))
+    sim_m = np.frombuffer(buffer, dtype=dtype, count=n1 * n2).reshape(n1, n2)
+
+    block_kwargs = _block_kwargs(similarity_func, r1, r2)
+
+    def fill_block(block: int) -> None:
+        rows1, rows2 = blocks[block]
+        kwargs = block_kwargs(rows1, rows2)
+        sim_m[rows1, rows2] = similarity_func(r1[rows1], r2[rows2],
+                                              **kwargs).filled(fill_value)
+
+    parallel_map(fill_block, len(blocks), workers)
+    return Similarity(sim_m)
+
+
+def knn_graph(r1: RatingMatrix,
+              r2: RatingMatrix,
+              similarity_func: FSimilarity,
+              fill_value: int,
+              m: int,
+              threshold: float | None = None,
+              pre_sort_sim: FPreSortSim | None = None,
+              weights: tuple[FloatMatrix, FloatMatrix] | None = None,
+              exclude_self: bool = False,
+              max_bytes: int = KNN_GRAPH_MAX_BYTES) -> NeighborGraph:
+    '''
+    Build the similarity between rows in r1 and r2 pruned to the top m neighbors
+    of every r1 row (see prune_neighbors). The similarity is computed and pruned
+    by blocks of r1 rows, so the full r1 x r2 matrix is never held in memory;
+    max_bytes bounds the working memory of a block.
+
+    exclude_self: drop every row from its own neighbors, when r1 and r2 are the
+        same matrix (e.g. item-item similarity).
+    '''
+    if weights is not None:
+        weight1, weight2 = weights
+        r1, r2 = r1 * weight1, r2 * weight2
+
+    n1, n2, k = r1.shape[0], r2.shape[0], r1.shape[1]
+    # Every block is computed against all of r2.
+    budget = max_bytes // np.dtype(float_type()).itemsize
+    size = (budget - _ROW_COPIES * n2 * k) // (_ROW_COPIES * k +
+                                               _PAIR_COPIES * n2)
+    size = min(n1, max(1, size))
+
+    neighbors = np.full((n1, min(m, n2)), -1, dtype=NpInt)
+    sims = np.zeros((n1, min(m, n2)), dtype=NpCompactFloat)
+    block_kwargs = _block_kwargs(similarity_func, r1, r2)
+    for i in range(0, n1, size):
+        kwargs = block_kwargs(slice(i, i + size), slice(None))
+        block = similarity_func(r1[i:i + size], r2, **kwargs).filled(fill_value)
+        neighbors[i:i + size], sims[i:i + size] = prune_neighbors(
+            block,
+            m,
+            threshold,
+            pre_sort_sim,
+            self_offset=i if exclude_self else None)
+
+    return NeighborGraph(neighbors, sims)
+
+
+def approximate_knn_graph(
         r1: RatingMatrix,
         r2: RatingMatrix,
         similarity_func: FSimilarity,
         fill_value: int,
-        weights: tuple[FloatMatrix, FloatMatrix] | None = None) -> Similarity:
+        m: int,
+        n_tables: int = LSH_TABLES,
+        n_bits: int | None = None,
+        opposite: bool = False,
+        threshold: float | None = None,
+        pre_sort_sim: FPreSortSim | None = None,
+        weights: tuple[FloatMatrix, FloatMatrix] | None = None,
+        seed: int = 0,
+        index: ProjectionIndex | None = None) -> NeighborGraph:
+    '''
+    Approximate knn_graph for cosine-like similarities (cosine, Pearson...): the
+    neighbors of every r1 row are searched only among its candidates in a
+    ProjectionIndex of r2, re-ranked by their exact similarity. The cost of a
+    row depends on the number of its candidates rather than on r2 rows.
+
+    n_tables, n_bits, seed: parameters of the index (see ProjectionIndex), which
+        is built over r2 unless given. More tables give a better recall.
+    opposite: also search the rows hashed like the negated r1 rows, for a
+        pre_sort_sim such as abs.
+    '''
     if weights is not None:
         weight1, weight2 = weights
-        sim_m = similarity_func(r1 * weight1, r2 * weight2).filled(fill_value)
-    else:
-        sim_m = similarity_func(r1, r2).filled(fill_value)
-    return Similarity(sim_m)
+        r1, r2 = r1 * weight1, r2 * weight2
+
+    if index is None:
+        index = ProjectionIndex(r2, n_tables, n_bits, seed)
+
+    m = min(m, r2.shape[0])
+    neighbors = np.full((r1.shape[0], m), -1, dtype=NpInt)
+    sims = np.zeros((r1.shape[0], m), dtype=NpCompactFloat)
+    block_kwargs = _block_kwargs(similarity_func, r1, r2)
+    for i, candidates in enumerate(index.query(r1, opposite)):
+        if len(candidates) == 0:
+            continue
+        kwargs = block_kwargs(slice(i, i + 1), candidates)
+        block = similarity_func(r1[i:i + 1], r2[candidates],
+                                **kwargs).filled(fill_value)
+        top, top_sims = prune_neighbors(block, m, threshold, pre_sort_sim)
+        # Kept neighbors come first, followed by the padding.
+        count = np.count_nonzero(top[0] >= 0)
+        neighbors[i, :count] = candidates[top[0, :count]]
+        sims[i, :count] = top_sims[0, :count]
+
+    return NeighborGraph(neighbors, sims)
+
+
+def similarity_blocks(n1: int, n2: int, k: int,
+                      max_bytes: int) -> list[tuple[slice, slice]]:
+    '''
+    Split an n1 x n2 similarity computation over k columns into blocks of rows
+    whose working memory stays within max_bytes (at least one row per block).
+    '''
+    item_size = np.dtype(float_type()).itemsize
+    budget = max_bytes // item_size
+
+    # Solve PAIR * b² + ROW * 2k * b <= budget for a square block b x b.
+    row_cost = _ROW_COPIES * 2 * k
+    disc = row_cost**2 + 4 * _PAIR_COPIES * budget
+    size = max(1, (isqrt(disc) - row_cost) // (2 * _PAIR_COPIES))
 
+    size1 = min(n1, size)
+    # Spend what is left of the budget on the r2 side when r1 is small.
+    size2 = (budget - _ROW_COPIES * k * size1) // (_ROW_COPIES * k +
+                                                   _PAIR_COPIES * size1)
+    size2 = min(n2, max(1, size2))
 
-def support_matrix(r1: RatingMatrix, r2: RatingMatrix) -> Support:
+    return [(slice(i, min(i + size1, n1)), slice(j, min(j + size2, n2)))
+            for i in range(0, n1, size1)
+            for j in range(0, n2, size2)]
+
+
+def _block_kwargs(similarity_func: FSimilarity, r1: RatingMatrix,
+                  r2: RatingMatrix) -> Callable[[Any, Any], dict[str, Any]]:
+    '''
+    Keyword arguments of a block of rows of r1 and r2, with the statistics of
+    the whole r1 and r2 that the similarity function declares (see blockwise),
+    so that a block is computed like the same rows of the whole matrix.
+    '''
+    block_kwargs = getattr(similarity_func, 'block_kwargs', None)
+    if block_kwargs is None:
+        return lambda rows1, rows2: {}
+    return block_kwargs(r1, r2)
+
+
+def difference_support_matrix(
+    r1: RatingMatrix,
+    r2: RatingMatrix,
+    fill_value: int,
+    weights: tuple[FloatMatrix, FloatMatrix] | None = None
+) -> tuple[Similarity, Support]:
+    '''
+    Slope one's average difference matrix and its support matrix, computed in
+    one pass from the same co-rating counts.
+    '''
+    if weights is not None:
+        weight1, weight2 = weights
+        r1, r2 = r1 * weight1, r2 * weight2
+
+    diff_m, count_m = average_difference_matrix(r1, r2, return_counts=True)
+    return Similarity(diff_m.filled(fill_value)), Support(count_m)
+
+
+def support_matrix(r1: RatingMatrix,
+                   r2: RatingMatrix,
+                   packed: bool = False) -> Support:
     '''
     r1: m x k matrix
     r2: n x k matrix
+    packed: count with popcounts over bit-packed indicators instead of a matrix
+        product, which takes 8x less memory for the indicators.
     return: matrix of size m x n of support(m, n); support(m, n) is defined by
         user-based: number of items user m and n both rated
         item-based: number of users item m and n are both rated
     '''
-    r1_na = r1[..., None]
-    r2t_na = r2.T[None, ...]
-    mask_m = np.transpose(r1_na.mask | r2t_na.mask, (0, 2, 1))
-    return Support(
-        (r1.shape[1] - np.count_nonzero(mask_m, axis=2)).astype(NpFloat))
+    if packed:
+        return Support(_packed_support(r1, r2).astype(float_type()))
+
+    # Counts are small integers, which the float product computes exactly.
+    return Support(rated_indicator(r1) @ rated_indicator(r2).T)
+
+
+def _packed_support(r1: RatingMatrix, r2: RatingMatrix) -> IntMatrix:
+    rated1 = np.packbits(~np.ma.getmaskarray(r1), axis=1)
+    rated2 = np.packbits(~np.ma.getmaskarray(r2), axis=1)
+
+    sup_m = int_matrix((r1.shape[0], r2.shape[0]))
+    # Bound the m x n x k/8 intermediate of each block of r1 rows.
+    size = max(1, _PACKED_BLOCK_BYTES // max(1, rated2.size))
+    for i in range(0, r1.shape[0], size):
+        common = rated1[i:i + size, None, :] & rated2[None, ...]
+        sup_m[i:i + size] = np.sum(_POPCOUNT[common], axis=2, dtype=NpInt)
+    return sup_m
@@ -1,22 +1,58 @@
 from __future__ import annotations
 
-from functools import cache
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 
 import numpy as np
 
+from ...typing import NpFloat, NpInt, float_matrix
+from ..shared.cache import bounded_cache
+
 if TYPE_CHECKING:
     from ...typing import (
         FIndexedSimMap,
         FloatArray,
+        FloatMatrix,
         FPreSortSim,
         IndexedSimArray,
+        IntArray,
+        IntMatrix,
+        RatingMatrix,
         Similarity,
+        StackedMatrix,
         Support,
     )
 
+# Bounds of the neighbor caches, which otherwise keep an indexed array for every
+# row of every similarity matrix seen by a long-running process.
+CACHE_MAX_BYTES = 1 << 28
+
+
+def top_desc(sort_m: FloatMatrix, m: int) -> IntMatrix:
+    '''
+    Column indices of the m highest values of every row of sort_m, in
+    descending order, ties broken by ascending index. The order does not
+    depend on m, so the top m are a prefix of the top m + 1.
+    '''
+    n = sort_m.shape[1]
+    m = min(max(m, 0), n)
+    if m == 0:
+        return np.empty((sort_m.shape[0], 0), dtype=NpInt)
+    top = np.argpartition(sort_m, n - m, axis=1)[:, n - m:]
+    top_sort = np.take_along_axis(sort_m, top, axis=1)
+
+    # argpartition picks arbitrary ones of the values tied with the mth, so the
+    # rows where they do not all fit are selected by a full stable sort.
+    kth = top_sort.min(axis=1, keepdims=True)
+    split = np.sum(sort_m == kth, axis=1) > np.sum(top_sort == kth, axis=1)
+    if split.any():
+        top[split] = np.argsort(-sort_m[split], axis=1, kind='stable')[:, :m]
+        top_sort[split] = np.take_along_axis(sort_m[split], top[split], axis=1)
 
-@cache
+    order = np.lexsort((top, -top_sort), axis=1)
+    return np.take_along_axis(top, order, axis=1).astype(NpInt)
+
+
+@bounded_cache(max_bytes=CACHE_MAX_BYTES)
 def indexed_desc_similarity(
         sim_row: int,
         similarity: Similarity,
@@ -31,16 +67,136 @@ def indexed_desc_similarity(
         sort_similarity_arr = pre_sort_sim(sort_similarity_arr)
 
     indexed_active_sim = np.column_stack((indices, active_sim.T))
-    reversed_sorted_index = sort_similarity_arr.argsort()[::-1]
-    desc_sim = indexed_active_sim[reversed_sorted_index]
+    desc_index = top_desc(sort_similarity_arr[np.newaxis],
+                          len(sort_similarity_arr))[0]
+    desc_sim = indexed_active_sim[desc_index]
 
     if map_func is not None:
         return map_func(desc_sim)
     return desc_sim
 
 
-@cache
+@bounded_cache(max_bytes=CACHE_MAX_BYTES)
 def indexed_support(sup_row: int, support: Support) -> IndexedSimArray:
     sup_m = support.raw
     indices = np.arange(0, sup_m.shape[1], dtype=sup_m.dtype)
     return np.column_stack((indices, sup_m[sup_row].T))
+
+
+def stack_indexed_sims(
+    sim_rows: IntArray,
+    indexed_sim: Callable[[int],
+                          IndexedSimArray]) -> tuple[IntMatrix, FloatMatrix]:
+    '''
+    Stack the indexed similarity arrays of sim_rows (built once per distinct
+    row) into a matrix of neighbor indices and a matrix of their similarities.
+    '''
+    unique_rows, inverse = np.unique(sim_rows, return_inverse=True)
+    indexed_sims = np.stack([indexed_sim(int(row)) for row in unique_rows])
+    return (indexed_sims[inverse, :, 0].astype(NpInt), indexed_sims[inverse, :,
+                                                                    1])
+
+
+def top_k_rated_neighbors(
+        sim_row: int,
+        rated_rows: IntArray,
+        k: int,
+        similarity: Similarity,
+        pre_sort_sim: FPreSortSim | None = None,
+        map_func: FIndexedSimMap | None = None) -> tuple[IntArray, FloatArray]:
+    '''
+    The k neighbors of sim_row with the highest (pre-sort) similarities among
+    rated_rows, i.e. the rows that have a value for the target column, in
+    descending order. All of them are returned when k is negative. Ties go to
+    the first of rated_rows (see top_desc), so that the top k are the first k
+    of the top k + 1.
+
+    Only the top k are sorted (O(n_rated + k log k)), and the neighbors come
+    back as an integer index array and a similarity array.
+    '''
+    active_sim = similarity.raw[sim_row, rated_rows]
+    sort_sim = active_sim if pre_sort_sim is None else pre_sort_sim(active_sim)
+
+    n = len(rated_rows)
+    top = top_desc(sort_sim[np.newaxis], k if 0 <= k < n else n)[0]
+
+    rows = rated_rows[top].astype(NpInt)
+    sims = active_sim[top]
+    if map_func is not None:
+        sims = map_func(np.column_stack((rows, sims)))[:, 1]
+    return rows, sims
+
+
+def stack_top_k_neighbors(
+        sim_rows: IntArray,
+        cols: IntArray,
+        ks: IntArray,
+        r: RatingMatrix | StackedMatrix,
+        similarity: Similarity,
+        pre_sort_sim: FPreSortSim | None = None,
+        map_func: FIndexedSimMap | None = None
+) -> tuple[IntMatrix, FloatMatrix]:
+    '''
+    top_k_rated_neighbors of a batch of questions, where the rated rows of a
+    question are the rows of r (among the similarity columns) that have a value
+    in the question's column. Returns a matrix of neighbor indices padded with
+    -1 and a matrix of their similarities padded with 0.
+    '''
+    n = similarity.raw.shape[1]
+    neighbors = [
+        top_k_rated_neighbors(int(sim_row),
+                              np.flatnonzero(~np.ma.getmaskarray(r[:n, col])),
+                              int(k), similarity, pre_sort_sim, map_func)
+        for sim_row, col, k in zip(sim_rows, cols, ks)
+    ]
+
+    width = max((len(rows) for rows, _ in neighbors), default=0)
+    rows_m = np.full((len(neighbors), width), -1, dtype=NpInt)
+    sims_m = float_matrix((len(neighbors), width))
+    for i, (rows, sims) in enumerate(neighbors):
+        rows_m[i, :len(rows)] = rows
+        sims_m[i, :len(sims)] = sims
+    return rows_m, sims_m
+
+
+def prune_neighbors(
+        sim_m: FloatMatrix,
+        m: int,
+        threshold: float | None = None,
+        pre_sort_sim: FPreSortSim | None = None,
+        self_offset: int | None = None) -> tuple[IntMatrix, FloatMatrix]:
+    '''
+    Top m neighbors of every row in a block of a similarity matrix, in
+    descending (pre-sort) similarity order, ties broken by index (see
+    top_desc). Neighbors whose pre-sort similarity is below threshold are
+    dropped.
+
+    self_offset: index of the first row of the block in the similarity columns,
+        to drop every row from its own neighbors (square similarity only).
+    return: matrix of neighbor indices padded with -1, and matrix of their
+        similarities padded with 0.
+    '''
+    sort_m = np.array(sim_m if pre_sort_sim is None else pre_sort_sim(sim_m),
+                      dtype=NpFloat)
+    rows = np.arange(sim_m.shape[0])
+    if self_offset is not None:
+        sort_m[rows, rows + self_offset] = -np.inf
+    if threshold is not None:
+        sort_m[sort_m < threshold] = -np.inf
+
+    top = top_desc(sort_m, m)
+    kept = np.isfinite(np.take_along_axis(sort_m, top, axis=1))
+    neighbors = np.where(kept, top, -1).astype(NpInt)
+    sims = np.where(kept, np.take_along_axis(sim_m, top, axis=1), 0)
+    return neighbors, sims
+
+
+def map_neighbor_weights(map_func: FIndexedSimMap | None, neighbors: IntMatrix,
+                         weights: FloatMatrix) -> FloatMatrix:
+    '''
+    Apply an indexed similarity map to a matrix of neighbors and weights.
+    '''
+    if map_func is None:
+        return weights
+    indexed_sim = np.column_stack((neighbors.ravel(), weights.ravel()))
+    return map_func(indexed_sim)[:, 1].reshape(weights.shape)
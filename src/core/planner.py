@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Sequence
+
+import numpy as np
+
+from ..io.artifact_cache import ArtifactCache, artifact_cache
+from ..typing import HashableMatrix, NeighborGraph, float_type, matrix_digest
+from .cf import (
+    difference_support_matrix,
+    knn_graph,
+    parallel_similarity_matrix,
+    support_matrix,
+)
+from .cf.funcs.similarity_func import average_difference_matrix
+
+if TYPE_CHECKING:
+    from ..config import Config
+    from ..typing import Similarity, Support, UserItemRatings
+    from .train import CFPredictor
+
+
+class SimilarityPlanner():
+    '''
+    Similarity matrices of a dataset, computed once for every distinct
+    similarity a predictor and config need, and shared by all of them.
+
+    Configs are fingerprinted by their similarity fields (sim_scheme,
+    sim_fill_value and the content of sim_weights), together with the
+    orientation of the predictor (user-user, item-item or item differences),
+    and by the current precision (see set_precision).
+    Matrices are also kept across runs in cache, keyed by the same fingerprint
+    and the content of the ratings they are computed from (see ArtifactCache).
+
+    graph_neighbors: give item-based CF a KNN graph of that many neighbors per
+        item (see knn_graph) instead of the full item similarity.
+    '''
+
+    def __init__(self,
+                 ratings: UserItemRatings,
+                 active_ratings: UserItemRatings,
+                 workers: int | None = None,
+                 cache: ArtifactCache | None = None,
+                 graph_neighbors: int | None = None) -> None:
+        self.ratings = ratings
+        self.active_ratings = active_ratings
+        self.workers = workers
+        self.graph_neighbors = graph_neighbors
+        self.cache = cache if cache is not None else artifact_cache
+        self._matrices: dict[Hashable, tuple[HashableMatrix, ...]] = {}
+
+    @staticmethod
+    def fingerprint(conf: Config) -> tuple[Hashable, ...]:
+        weights = conf.sim_weights
+        return (conf.sim_scheme, conf.sim_fill_value,
+                None if weights is None else tuple(
+                    matrix_digest(weight) for weight in weights))
+
+    def similarities(self, predictor: CFPredictor,
+                     conf: Config) -> dict[str, Similarity | Support]:
+        '''
+        Keyword arguments of the predictor that provide its precomputed
+        similarities under conf.
+        '''
+        name = predictor.__name__
+        if name == 'user_based_cf':
+            return {'user_similarity': self._similarity('user', conf)}
+        elif name == 'item_based_cf':
+            if self.graph_neighbors is not None:
+                return {
+                    'item_graph': self._item_graph(conf, self.graph_neighbors)
+                }
+            return {'item_similarity': self._similarity('item', conf)}
+        elif name == 'slope_one_cf':
+            r = self.ratings.raw
+            if conf.sim_scheme is average_difference_matrix:
+                # Both come from the same co-rating counts.
+                item_diff, item_diff_sup = self._cached(
+                    ('difference',) + self.fingerprint(conf),
+                    ('difference', 'support'),
+                    (r, conf.sim_fill_value, conf.sim_weights),
+                    lambda: difference_support_matrix(
+                        r.T, r.T, conf.sim_fill_value, weights=conf.sim_weights
+                    ))
+            else:
+                item_diff = self._similarity('item', conf)
+                item_diff_sup, = self._cached(('support',), ('support',), (r,),
+                                              lambda:
+                                              (support_matrix(r.T, r.T),))
+            return {'item_diff': item_diff, 'item_diff_sup': item_diff_sup}
+        raise NameError(f'predictor not found ({name})')
+
+    def _similarity(self, orientation: str, conf: Config) -> Similarity:
+        if orientation == 'user':
+            r1, r2 = self.active_ratings.raw, self.ratings.raw
+            inputs: tuple[Any, ...] = (r1, r2)
+        else:
+            r1, r2 = self.ratings.raw.T, self.ratings.raw.T
+            inputs = (self.ratings.raw,)
+
+        similarity, = self._cached(
+            (orientation,) + self.fingerprint(conf), ('similarity',),
+            inputs + (conf.sim_scheme, conf.sim_fill_value, conf.sim_weights),
+            lambda: (parallel_similarity_matrix(r1,
+                                                r2,
+                                                conf.sim_scheme,
+                                                conf.sim_fill_value,
+                                                weights=conf.sim_weights,
+                                                workers=self.workers),))
+        return similarity
+
+    def _item_graph(self, conf: Config, m: int) -> NeighborGraph:
+        r = self.ratings.raw
+        neighbors, weights = self._cached(
+            ('graph', m, conf.pre_sort_sim) + self.fingerprint(conf),
+            ('neighbors', 'weights'), (r, conf.sim_scheme, conf.sim_fill_value,
+                                       conf.sim_weights, m, conf.pre_sort_sim),
+            lambda: self._graph_matrices(conf, m))
+        return NeighborGraph(neighbors.raw, weights.raw)
+
+    def _graph_matrices(self, conf: Config,
+                        m: int) -> tuple[HashableMatrix, ...]:
+        r = self.ratings.raw
+        graph = knn_graph(r.T,
+                          r.T,
+                          conf.sim_scheme,
+                          conf.sim_fill_value,
+                          m,
+                          pre_sort_sim=conf.pre_sort_sim,
+                          weights=conf.sim_weights,
+                          exclude_self=True)
+        return HashableMatrix(graph.neighbors), HashableMatrix(graph.weights)
+
+    def _cached(
+        self, key: tuple[Hashable, ...], names: tuple[str, ...],
+        inputs: tuple[Any, ...], compute: Callable[[], Sequence[HashableMatrix]]
+    ) -> tuple[HashableMatrix, ...]:
+        '''
+        Matrices under key, from memory, from the artifact cache (keyed by key
+        and inputs) or computed.
+        '''
+        # Matrices built under another precision are not shared.
+        key += (np.dtype(float_type()).str,)
+        if key not in self._matrices:
+            disk_key = self.cache.fingerprint(
+                key[0], key[-1], *inputs) if self.cache.enabled else None
+            self._matrices[key] = self.cache.get_or_compute(
+                disk_key, names, compute)
+        return self._matrices[key]
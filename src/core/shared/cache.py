@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from functools import update_wrapper
+from threading import RLock
+from typing import Any, Callable, NamedTuple, TypeVar
+from weakref import finalize
+
+from ...typing import HashableMatrix
+
+T = TypeVar('T')
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int | None
+    currsize: int
+    max_bytes: int | None
+    currbytes: int
+
+
+def bounded_cache(
+    maxsize: int | None = None,
+    max_bytes: int | None = None
+) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    '''
+    Thread-safe LRU cache bounded by the number of entries (maxsize) and/or by
+    the total nbytes of the cached values (max_bytes). Like functools.lru_cache,
+    the wrapped function gets cache_info() and cache_clear().
+
+    HashableMatrix arguments are keyed by their digest and only weakly
+    referenced, so the cache never keeps a matrix alive: the entries of a matrix
+    are dropped once no matrix of the same content is left.
+    '''
+
+    def decorate(func: Callable[..., T]) -> Callable[..., T]:
+        entries: OrderedDict[Any, tuple[T, int]] = OrderedDict()
+        lock = RLock()
+        stats = {'hits': 0, 'misses': 0, 'bytes': 0}
+        # Ids of the live matrices in the keys, and their number per digest.
+        tracked: set[int] = set()
+        owners: dict[str, int] = {}
+
+        def key_part(arg: Any) -> Any:
+            if isinstance(arg, HashableMatrix):
+                return (HashableMatrix, arg.digest)
+            return arg
+
+        def matrix_digests(key: Any) -> list[str]:
+            args, kwargs = key
+            return [
+                part[1]
+                for part in (*args, *(arg for _, arg in kwargs))
+                if isinstance(part, tuple) and len(part) == 2
+                and part[0] is HashableMatrix
+            ]
+
+        def track(arg: Any) -> None:
+            if not isinstance(arg, HashableMatrix) or id(arg) in tracked:
+                return
+            tracked.add(id(arg))
+            owners[arg.digest] = owners.get(arg.digest, 0) + 1
+            finalize(arg, release, id(arg), arg.digest)
+
+        def release(arg_id: int, digest: str) -> None:
+            with lock:
+                tracked.discard(arg_id)
+                owners[digest] -= 1
+                if owners[digest] > 0:
+                    return
+                del owners[digest]
+                for key in list(entries):
+                    if digest not in matrix_digests(key):
+                        continue
+                    _, size = entries.pop(key)
+                    stats['bytes'] -= size
+
+        def evict() -> None:
+            while entries and (
+                (maxsize is not None and len(entries) > maxsize) or
+                (max_bytes is not None and stats['bytes'] > max_bytes)):
+                _, (_, size) = entries.popitem(last=False)
+                stats['bytes'] -= size
+
+        def wrapped(*args, **kwargs) -> T:
+            key = (
+                tuple(key_part(arg) for arg in args),
+                tuple(
+                    sorted(
+                        (name, key_part(arg)) for name, arg in kwargs.items())))
+            with lock:
+                if key in entries:
+                    stats['hits'] += 1
+                    for arg in (*args, *kwargs.values()):
+                        track(arg)
+                    entries.move_to_end(key)
+                    return entries[key][0]
+                stats['misses'] += 1
+
+            # Computed outside of the lock, so that other threads are not
+            # blocked meanwhile. Racing threads may compute the same value.
+            value = func(*args, **kwargs)
+            size = int(getattr(value, 'nbytes', 0))
+
+            with lock:
+                if key not in entries:
+                    for arg in (*args, *kwargs.values()):
+                        track(arg)
+                    entries[key] = (value, size)
+                    stats['bytes'] += size
+                    evict()
+            return value
+
+        def cache_info() -> CacheInfo:
+            with lock:
+                return CacheInfo(stats['hits'], stats['misses'], maxsize,
+                                 len(entries), max_bytes, stats['bytes'])
+
+        def cache_clear() -> None:
+            with lock:
+                entries.clear()
+                stats.update(hits=0, misses=0, bytes=0)
+
+        wrapped.cache_info = cache_info    # type: ignore
+        wrapped.cache_clear = cache_clear    # type: ignore
+        return update_wrapper(wrapped, func)
+
+    return decorate
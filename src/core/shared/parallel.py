@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import itertools
+import os
+import sys
+import threading
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, TypeVar
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+T = TypeVar('T')
+
+# Tasks of the running parallel_map calls, by job id. Forked workers inherit
+# them, with the matrices and configs they close over, instead of receiving
+# them through pickling (configs hold closures, which cannot be pickled anyway).
+# Only the job id and the index are sent with every task.
+_parallel_jobs: dict[int, Callable[[int], Any]] = {}
+_job_ids = itertools.count()
+_jobs_lock = threading.Lock()
+# Set in the threads (and forked processes) running a task, whose nested
+# parallel_map calls run serially.
+_worker = threading.local()
+
+
+def parallel_map(func: Callable[[int], T],
+                 n: int,
+                 workers: int | None = None) -> list[T]:
+    '''
+    [func(i) for i in range(n)], computed by a pool of workers (one per core
+    by default) and returned in order.
+
+    Workers are forked processes on Linux, and threads elsewhere (forked
+    processes may crash with macOS system frameworks). Forked workers share
+    the read-only buffers of the caller copy on write; only the indices and the
+    results, which must be picklable, are sent between processes. With a single
+    worker or task, and in nested calls from the workers, func runs serially in
+    the caller.
+    '''
+    workers = min(workers or os.cpu_count() or 1, n)
+    if workers <= 1 or getattr(_worker, 'active', False):
+        return [func(i) for i in range(n)]
+
+    with _jobs_lock:
+        job = next(_job_ids)
+        _parallel_jobs[job] = func
+    try:
+        with _build_executor(workers) as executor:
+            return list(executor.map(partial(_run_task, job), range(n)))
+    finally:
+        with _jobs_lock:
+            del _parallel_jobs[job]
+
+
+def _build_executor(workers: int) -> Executor:
+    # Imported on use, as multiprocessing is slow to import.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    if sys.platform.startswith('linux'):
+        return ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('fork'))
+    return ThreadPoolExecutor(workers)
+
+
+def _run_task(job: int, i: int) -> Any:
+    _worker.active = True
+    try:
+        return _parallel_jobs[job](i)
+    finally:
+        _worker.active = False
+
+
+def chunk_map(func: Callable[[slice], T],
+              n: int,
+              chunk_size: int,
+              workers: int | None = None) -> list[T]:
+    '''
+    func of every chunk_size slice of range(n), computed by a pool of threads
+    (one per core by default) and returned in order.
+
+    Meant for NumPy work that mostly releases the GIL. Threads share the
+    arrays of the caller, so func can write its results into its own slice of
+    a preallocated array. With a single worker or chunk, func runs serially in
+    the caller.
+    '''
+    chunks = [
+        slice(start, start + chunk_size) for start in range(0, n, chunk_size)
+    ]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers <= 1:
+        return [func(chunk) for chunk in chunks]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(func, chunks))
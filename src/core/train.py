@@ -3,53 +3,50 @@ from __future__ import annotations
 from typing import Callable, Concatenate, ParamSpec
 
 from ..config import Config
-from ..core.cf import similarity_matrix
+from ..core.cf.prediction import is_batched
+from ..core.shared.parallel import parallel_map
 from ..io import report_cf_test
 from ..loss import loss_mae
-from ..typing import PredictionArray, Questions, UserItemRatings
-from ..utils import round_prediction
+from ..typing import PredictionArray, Questions, UserItemRatings, int_array
+from ..utils import round_predictions
+from .planner import SimilarityPlanner
 
 P = ParamSpec('P')
 CFPredictor = Callable[Concatenate[UserItemRatings, UserItemRatings, Questions,
                                    Config, P], PredictionArray]
 BestComp = tuple[float, Config | None]
 
+# Predictors that take a k_range to predict for many k in a single pass.
+_SWEEP_PREDICTORS = ('user_based_cf', 'item_based_cf')
 
-def train_cf(ratings: UserItemRatings,
-             active_ratings: UserItemRatings,
-             questions: Questions,
-             predictor: CFPredictor,
-             conf_list: list[Config],
-             verbosity: int = 1) -> BestComp:
+
+def _sweepable(predictor: CFPredictor, conf_list: list[Config]) -> bool:
+    '''
+    Whether the configs differ only in an integer knn_k, so that all of them
+    can be evaluated in a single pass.
+    '''
     init_conf = conf_list[0]
-    if predictor.__name__ == 'slope_one_cf':
-        sim_m = init_conf.sim_scheme(ratings.raw.T, ratings.raw.T).filled(
-            init_conf.sim_fill_value)
-    elif predictor.__name__ == 'user_based_cf':
-        sim_m = similarity_matrix(active_ratings.raw,
-                                  ratings.raw,
-                                  init_conf.sim_scheme,
-                                  init_conf.sim_fill_value,
-                                  weights=init_conf.sim_weights)
-    elif predictor.__name__ == 'item_based_cf':
-        sim_m = similarity_matrix(ratings.raw.T,
-                                  ratings.raw.T,
-                                  init_conf.sim_scheme,
-                                  init_conf.sim_fill_value,
-                                  weights=init_conf.sim_weights)
-    else:
-        raise NameError(f'predictor not found ({predictor.__name__})')
+    if predictor.__name__ not in _SWEEP_PREDICTORS or not is_batched(
+            init_conf.prediction):
+        return False
 
-    best: BestComp = (5, None)
-    for conf in conf_list:
-        # We can only train K value when it's not dynamic.
-        assert isinstance(conf.knn_k, int)
+    fields = [field for field in init_conf.__dict__ if field != '_knn_k']
+    return all(
+        isinstance(conf.knn_k, int) and all(conf[field] is init_conf[field]
+                                            for field in fields)
+        for conf in conf_list)
+
+
+def _mae(questions: Questions, predictions: PredictionArray) -> float:
+    # For training data, q should have ground truth as the 3rd column of the
+    # entry array.
+    return loss_mae(questions.ground_truth(), round_predictions(predictions))
 
-        predictions = predictor(ratings, active_ratings, questions, conf, sim_m)
-        # For training data, q should have ground truth as the 3rd column of the
-        # entry array.
-        mae = loss_mae(questions.ground_truth(),
-                       [round_prediction(pred) for pred in predictions])
+
+def _best_conf(predictor: CFPredictor, conf_list: list[Config],
+               maes: list[float], verbosity: int) -> BestComp:
+    best: BestComp = (5, None)
+    for conf, mae in zip(conf_list, maes):
         if mae < best[0]:
             best = (mae, conf)
 
@@ -60,3 +57,58 @@ def train_cf(ratings: UserItemRatings,
         print(f'\nBest: MAE {best[0]}\n{best[1]}')
 
     return best
+
+
+def train_cf(ratings: UserItemRatings,
+             active_ratings: UserItemRatings,
+             questions: Questions,
+             predictor: CFPredictor,
+             conf_list: list[Config],
+             verbosity: int = 1,
+             workers: int | None = None) -> BestComp:
+    '''
+    Evaluate every config on the questions and return the best one by MAE.
+    Configs that differ only in knn_k are evaluated in a single k sweep;
+    otherwise the configs are evaluated by a pool of workers (see parallel_map)
+    and reported in order.
+    '''
+    # Every distinct similarity is computed once, before forking the workers.
+    planner = SimilarityPlanner(ratings, active_ratings)
+    sims = [planner.similarities(predictor, conf) for conf in conf_list]
+
+    if _sweepable(predictor, conf_list):
+        k_range = int_array([conf.knn_k for conf in conf_list])
+        sweep = predictor(ratings,
+                          active_ratings,
+                          questions,
+                          conf_list[0],
+                          k_range=k_range,
+                          **sims[0])
+        maes = [_mae(questions, predictions) for predictions in sweep]
+        return _best_conf(predictor, conf_list, maes, verbosity)
+
+    def conf_mae(i: int) -> float:
+        conf = conf_list[i]
+        # We can only train K value when it's not dynamic.
+        assert isinstance(conf.knn_k, int)
+        return _mae(
+            questions,
+            predictor(ratings, active_ratings, questions, conf, **sims[i]))
+
+    maes = parallel_map(conf_mae, len(conf_list), workers)
+    return _best_conf(predictor, conf_list, maes, verbosity)
+
+
+def train_cf_k(ratings: UserItemRatings,
+               active_ratings: UserItemRatings,
+               questions: Questions,
+               predictor: CFPredictor,
+               conf: Config,
+               k_range: list[int],
+               verbosity: int = 1) -> BestComp:
+    '''
+    train_cf over the configs conf with every knn_k of k_range.
+    '''
+    conf_list = [conf + {'knn_k': k} for k in k_range]
+    return train_cf(ratings, active_ratings, questions, predictor, conf_list,
+                    verbosity)
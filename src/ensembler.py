@@ -1,96 +1,139 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Callable
 
-from skopt import gp_minimize
-from skopt.space import Integer, Real
-from skopt.utils import use_named_args
+import numpy as np
 
-from .core.cf import similarity_matrix, support_matrix
+from .core.planner import SimilarityPlanner
 from .io import aggregate_cross_validation, read_entries, read_split_entries
 from .loss import loss_rmse
 from .predictors import item_based_cf, slope_one_cf, user_based_cf
 from .presets import dynamic_presets, presets
 
 if TYPE_CHECKING:
-    from .typing import Questions, UserItemRatings
-
-search_space = [
-    Real(0, 1, name='weight_slope_one'),
-    Real(0, 1, name='weight_item_corr'),
-    Real(0, 1, name='weight_user_corr_iuf'),
-    Real(0, 1, name='weight_user_cos'),
-    Integer(1, 50, name='k_user_corr_iuf'),
-    Integer(1, 50, name='k_user_cos')
-]
-
-# Pre-computed values.
-_r, _a, _q = aggregate_cross_validation(*read_split_entries(0.1))
-# _r, _a, _q = aggregate_cross_validation(
-#     read_entries('data/uvi/train.uvi5.extend.txt'),
-#     read_entries('data/uvi/test.uvi5.extend.txt'))
-
-_slope_one_diff = similarity_matrix(_r.raw.T, _r.raw.T,
-                                    presets['slope_one'].sim_scheme, 0)
-_slope_one_sup = support_matrix(_r.raw.T, _r.raw.T)
-_item_corr_sim = similarity_matrix(_r.raw.T, _r.raw.T,
-                                   presets['corr'].sim_scheme, 0)
-_user_corr_iuf_sim = similarity_matrix(_a.raw,
-                                       _r.raw,
-                                       presets['corr'].sim_scheme,
-                                       0,
-                                       weights=dynamic_presets['iuf'](
-                                           _r.raw).sim_weights)
-_user_cos_sim = similarity_matrix(_a.raw, _r.raw, presets['cos'].sim_scheme, 0)
+    from skopt.space import Dimension
+
+    from .typing import PredictionArray, Questions, UserItemRatings
+
+# Range of the k hyperparameters.
+K_MIN, K_MAX = 1, 50
+
+# Hyperparameters of linear_ensembler, in the order of the search space.
+HPARAM_NAMES = ('weight_slope_one', 'weight_item_corr', 'weight_user_corr_iuf',
+                'weight_user_cos', 'k_user_corr_iuf', 'k_user_cos')
+
+
+def _search_space() -> list[Dimension]:
+    # skopt is slow to import and only needed for the search.
+    from skopt.space import Integer, Real
+
+    return [
+        Real(0, 1, name='weight_slope_one'),
+        Real(0, 1, name='weight_item_corr'),
+        Real(0, 1, name='weight_user_corr_iuf'),
+        Real(0, 1, name='weight_user_cos'),
+        Integer(K_MIN, K_MAX, name='k_user_corr_iuf'),
+        Integer(K_MIN, K_MAX, name='k_user_cos')
+    ]
+
+
+class _BasePredictions():
+    '''
+    Predictions of the ensembled predictors on the validation questions. Only
+    the k of user-based CF changes them, so they are computed once for the whole
+    k range (one row per k) and every evaluation is a linear combination of
+    them.
+    '''
+
+    def __init__(self) -> None:
+        r, a, q = aggregate_cross_validation(*read_split_entries(0.1))
+        # r, a, q = aggregate_cross_validation(
+        #     read_entries('data/uvi/train.uvi5.extend.txt'),
+        #     read_entries('data/uvi/test.uvi5.extend.txt'))
+        self.q: Questions = q
+
+        # Loaded from the artifact cache on repeat runs.
+        planner = SimilarityPlanner(r, a)
+        slope_one_sims = planner.similarities(slope_one_cf,
+                                              presets['slope_one'])
+        item_corr_sims = planner.similarities(item_based_cf, presets['corr'])
+        user_corr_iuf_sims = planner.similarities(
+            user_based_cf, presets['corr'] + dynamic_presets['iuf'](r.raw))
+        user_cos_sims = planner.similarities(user_based_cf, presets['cos'])
+
+        k_range = np.arange(K_MIN, K_MAX + 1)
+        self.slope_one: PredictionArray = slope_one_cf(
+            r, a, q, presets['slope_one'] + presets['item_based_k'],
+            **slope_one_sims)
+        self.item_corr: PredictionArray = item_based_cf(
+            r, a, q, presets['corr'] + presets['item_based_k'],
+            **item_corr_sims)
+        self.user_corr_iuf: PredictionArray = user_based_cf(
+            r, a, q, presets['corr'], k_range=k_range, **user_corr_iuf_sims)
+        self.user_cos: PredictionArray = user_based_cf(r,
+                                                       a,
+                                                       q,
+                                                       presets['cos'],
+                                                       k_range=k_range,
+                                                       **user_cos_sims)
+
+
+# Built on first access, so that importing the module reads no data.
+_lazy: dict[str, Callable[[], Any]] = {
+    'search_space': _search_space,
+    'base_predictions': _BasePredictions,
+}
+_built: dict[str, Any] = {}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _lazy:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if name not in _built:
+        _built[name] = _lazy[name]()
+    return _built[name]
 
 
 def linear_ensembler(weight_slope_one: float = 1,
                      weight_item_corr: float = 1,
                      weight_user_corr_iuf: float = 1,
                      weight_user_cos: float = 1,
-                     k_user_corr_iuf: int = 1,
-                     k_user_cos: int = 1):
-    slope_one_pred = slope_one_cf(_r,
-                                  _a,
-                                  _q,
-                                  presets['slope_one'] +
-                                  presets['item_based_k'],
-                                  item_diff=_slope_one_diff,
-                                  item_diff_sup=_slope_one_sup)
-    item_corr_pred = item_based_cf(_r,
-                                   _a,
-                                   _q,
-                                   presets['corr'] + presets['item_based_k'],
-                                   item_similarity=_item_corr_sim)
-    user_corr_iuf_pred = user_based_cf(_r,
-                                       _a,
-                                       _q,
-                                       presets['corr'] +
-                                       {'knn_k': k_user_corr_iuf},
-                                       user_similarity=_user_corr_iuf_sim)
-    user_cos_pred = user_based_cf(_r,
-                                  _a,
-                                  _q,
-                                  presets['cos'] + {'knn_k': k_user_cos},
-                                  user_similarity=_user_cos_sim)
-
-    predictions = weight_slope_one * slope_one_pred + \
-                weight_item_corr * item_corr_pred + \
+                     k_user_corr_iuf: float = 1,
+                     k_user_cos: float = 1):
+    # A k may come as a float, from a Real dimension or a hand-written point.
+    ks = {'k_user_corr_iuf': k_user_corr_iuf, 'k_user_cos': k_user_cos}
+    for name, k in ks.items():
+        ks[name] = int(round(k))
+        if not K_MIN <= ks[name] <= K_MAX:
+            raise ValueError(f'{name} must be in [{K_MIN}, {K_MAX}], got {k}.')
+
+    base: _BasePredictions = __getattr__('base_predictions')
+    user_corr_iuf_pred = base.user_corr_iuf[ks['k_user_corr_iuf'] - K_MIN]
+    user_cos_pred = base.user_cos[ks['k_user_cos'] - K_MIN]
+
+    predictions = weight_slope_one * base.slope_one + \
+                weight_item_corr * base.item_corr + \
                 weight_user_corr_iuf * user_corr_iuf_pred + \
                 weight_user_cos * user_cos_pred
 
     return predictions
 
 
-@use_named_args(search_space)
-def evaluate_ensembler(**hparams):
-    predictions = linear_ensembler(**hparams)
-    loss = loss_rmse(_q.ground_truth(), predictions)
+def evaluate_ensembler(params: list[float]) -> float:
+    '''
+    Loss of linear_ensembler with the hyperparameters params, in the order of
+    HPARAM_NAMES (i.e. a point of the search space).
+    '''
+    base: _BasePredictions = __getattr__('base_predictions')
+    predictions = linear_ensembler(**dict(zip(HPARAM_NAMES, params)))
+    loss = loss_rmse(base.q.ground_truth(), predictions)
     return loss
 
 
 if __name__ == '__main__':
-    result = gp_minimize(evaluate_ensembler, search_space)
+    from skopt import gp_minimize
+
+    result = gp_minimize(evaluate_ensembler, _search_space(), random_state=0)
     print(f'Best RMSE: {result.fun}')
     print(
         f'Best Parameters: w1={result.x[0]}, w2={result.x[1]}, w3={result.x[2]}, w4={result.x[3]}, k_corr={result.x[4]}, k_cos={result.x[5]}'
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import time
+from typing import TYPE_CHECKING, Callable
 
-from .core.train import train_cf
+from .core.cf import approximate_knn_graph, graph_recall, knn_graph
+from .core.planner import SimilarityPlanner
+from .core.shared.parallel import parallel_map
+from .core.train import train_cf_k
 from .io import (
     aggregate_all,
     aggregate_cross_validation,
@@ -14,7 +18,7 @@ from .io import (
 from .loss import loss_mae
 from .predictors import item_based_cf, slope_one_cf, user_based_cf
 from .presets import dynamic_presets, presets
-from .utils import round_prediction
+from .utils import round_predictions
 from .variants import (
     build_case_amp_iuf_variants,
     build_case_amp_variants,
@@ -30,15 +34,40 @@ if TYPE_CHECKING:
     from .variants import Variant
 
 
-def _run_variants(variants: list[Variant], r: UserItemRatings,
-                  a: UserItemRatings, q: Questions):
-    for variant in variants:
-        predictor = variant['predictor']
-        conf = variant['conf']
-        predictions = predictor(r, a, q, conf)
-        mae = loss_mae(q.ground_truth(),
-                       [round_prediction(pred) for pred in predictions])
-        report_cf_test(predictor.__name__, conf, mae)
+def _variant_maes(variants: list[Variant],
+                  r: UserItemRatings,
+                  a: UserItemRatings,
+                  q: Questions,
+                  workers: int | None = None) -> list[float]:
+    '''
+    MAE of every variant, evaluated by a pool of workers (see parallel_map).
+    '''
+    # Every distinct similarity is computed once, before forking the workers.
+    planner = SimilarityPlanner(r, a)
+    sims = [
+        planner.similarities(variant['predictor'], variant['conf'])
+        for variant in variants
+    ]
+
+    def variant_mae(i: int) -> float:
+        variant = variants[i]
+        predictions = variant['predictor'](r, a, q, variant['conf'], **sims[i])
+        return loss_mae(q.ground_truth(), round_predictions(predictions))
+
+    return parallel_map(variant_mae, len(variants), workers)
+
+
+def _run_variants(variants: list[Variant],
+                  r: UserItemRatings,
+                  a: UserItemRatings,
+                  q: Questions,
+                  workers: int | None = None):
+    '''
+    Evaluate the variants (see _variant_maes), and report them in order.
+    '''
+    maes = _variant_maes(variants, r, a, q, workers)
+    for variant, mae in zip(variants, maes):
+        report_cf_test(variant['predictor'].__name__, variant['conf'], mae)
 
 
 class CrossValidationExperiment():
@@ -70,21 +99,106 @@ class CrossValidationExperiment():
             self._best_k_user_based(conf, list(range(1, 50)), name)
 
     def _best_k_user_based(self, conf: Config, k_range: list[int], name: str):
-        conf_list = [conf + {'knn_k': k} for k in k_range]
-        best_mae, best_conf = train_cf(
+        best_mae, best_conf = train_cf_k(
             *self.raq,
             user_based_cf,    # type: ignore
-            conf_list,
+            conf,
+            k_range,
             verbosity=0)
         print(f'Best K value for {name} is {best_conf.knn_k}' +
               f', with MAE {best_mae}')
 
+    def approximate_user_based(self,
+                               tables_range: tuple[int, ...] = (1, 2, 4, 8),
+                               n_bits: int | None = None):
+        # MAE loss of user-based CF with LSH neighbors against the exact ones,
+        # for every number of hash tables.
+        for name in ('cos', 'corr'):
+            conf = presets[name] + {'knn_k': 20}
+            opposite = conf.pre_sort_sim is abs
+
+            start = time.perf_counter()
+            exact = user_based_cf(*self.raq, conf)
+            elapsed = time.perf_counter() - start
+            exact_mae = loss_mae(self.q.ground_truth(),
+                                 round_predictions(exact))
+            print(f'{name}: exact MAE {exact_mae} in {elapsed:.3f}s')
+
+            # Every candidate is kept, so that the neighbors that rated the
+            # question's movie can be taken among them.
+            m = self.r.raw.shape[0]
+            exact_graph = knn_graph(self.a.raw,
+                                    self.r.raw,
+                                    conf.sim_scheme,
+                                    conf.sim_fill_value,
+                                    m,
+                                    pre_sort_sim=conf.pre_sort_sim)
+            for n_tables in tables_range:
+                start = time.perf_counter()
+                graph = approximate_knn_graph(self.a.raw,
+                                              self.r.raw,
+                                              conf.sim_scheme,
+                                              conf.sim_fill_value,
+                                              m,
+                                              n_tables=n_tables,
+                                              n_bits=n_bits,
+                                              opposite=opposite,
+                                              pre_sort_sim=conf.pre_sort_sim)
+                predictions = user_based_cf(*self.raq, conf, user_graph=graph)
+                elapsed = time.perf_counter() - start
+
+                mae = loss_mae(self.q.ground_truth(),
+                               round_predictions(predictions))
+                print(f'{name}: {n_tables} tables, recall ' +
+                      f'{graph_recall(graph, exact_graph, conf.knn_k):.3f}, ' +
+                      f'MAE {mae} ({mae - exact_mae:+.4f}) in {elapsed:.3f}s')
+
+    def pruned_item_based(self,
+                          neighbors_range: tuple[int,
+                                                 ...] = (50, 100, 200, 500)):
+        # MAE of item-based CF with the item similarity pruned to a KNN graph of
+        # every number of neighbors, against the full item similarity.
+        conf = presets['adj_cos'] + presets['item_based_k']
+        for graph_neighbors in (None, *neighbors_range):
+            planner = SimilarityPlanner(self.r,
+                                        self.a,
+                                        graph_neighbors=graph_neighbors)
+            start = time.perf_counter()
+            predictions = item_based_cf(
+                *self.raq, conf, **planner.similarities(item_based_cf, conf))
+            elapsed = time.perf_counter() - start
+
+            mae = loss_mae(self.q.ground_truth(),
+                           round_predictions(predictions))
+            name = 'full' if graph_neighbors is None else (
+                f'{graph_neighbors} neighbors')
+            print(f'{name}: MAE {mae} in {elapsed:.3f}s')
+
+
+# Experiments read and aggregate their data, so they are built on first access
+# (e.g. experiments.uvi_5) and then kept.
+_experiments: dict[str, Callable[[], CrossValidationExperiment]] = {
+    'simple_run':
+        lambda: CrossValidationExperiment(*read_split_entries(0.05)),
+    'uvi_5':
+        lambda: CrossValidationExperiment(
+            read_entries('data/uvi/train.uvi5.txt'),
+            read_entries('data/uvi/test.uvi5.txt')),
+    'uvi_20':
+        lambda: CrossValidationExperiment(
+            read_entries('data/uvi/train.uvi20.txt'),
+            read_entries('data/uvi/test.uvi20.txt')),
+}
+_built: dict[str, CrossValidationExperiment] = {}
+
+
+def __getattr__(name: str) -> CrossValidationExperiment:
+    if name not in _experiments:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if name not in _built:
+        _built[name] = _experiments[name]()
+    return _built[name]
 
-simple_run = CrossValidationExperiment(*read_split_entries(0.05))
-uvi_5 = CrossValidationExperiment(read_entries('data/uvi/train.uvi5.txt'),
-                                  read_entries('data/uvi/test.uvi5.txt'))
-uvi_20 = CrossValidationExperiment(read_entries('data/uvi/train.uvi20.txt'),
-                                   read_entries('data/uvi/test.uvi20.txt'))
 
 _best_hparams_general = {
     'slope_one': 0.04869672913367798,
@@ -139,11 +253,19 @@ def predict_write_real():
             print(conf)
             printed = True
 
-        predictions = predictor(r, a, q, conf)
+        # Item similarities only depend on the training ratings, so the
+        # artifact cache shares them across the test files.
+        planner = SimilarityPlanner(r, a)
+        # Questions are predicted by a thread per core.
+        predictions = predictor(r,
+                                a,
+                                q,
+                                conf,
+                                workers=None,
+                                **planner.similarities(predictor, conf))
         q.take_answers(predictions)
 
-        with open(f'data/outputs/{fname}.{infix}.txt', 'w+') as f:
-            f.write(str(q))
+        q.write_answers(f'data/outputs/{fname}.{infix}.txt')
 
 
 def predict_write_real_ensemble():
@@ -160,29 +282,38 @@ def predict_write_real_ensemble():
     for fname in fnames:
         test_arr = read_entries(f'data/task/{fname}.txt')
         r, a, q = aggregate_all(train_arr, test_arr)
+        planner = SimilarityPlanner(r, a)
         slope_one_pred = slope_one_cf(
             r,
             a,
             q,
             presets['slope_one'] + presets['item_based_k'],
+            workers=None,
+            **planner.similarities(slope_one_cf, presets['slope_one']),
         )
         item_corr_pred = item_based_cf(
             r,
             a,
             q,
             presets['corr'] + presets['item_based_k'],
+            workers=None,
+            **planner.similarities(item_based_cf, presets['corr']),
         )
         user_corr_iuf_pred = user_based_cf(
             r,
             a,
             q,
             presets['corr'] + {'knn_k': hparams['k_user_corr_iuf']},
+            workers=None,
+            **planner.similarities(user_based_cf, presets['corr']),
         )
         user_cos_pred = user_based_cf(
             r,
             a,
             q,
             presets['cos'] + {'knn_k': hparams['k_user_cos']},
+            workers=None,
+            **planner.similarities(user_based_cf, presets['cos']),
         )
 
         predictions = hparams['slope_one'] * slope_one_pred + hparams[
@@ -191,8 +322,7 @@ def predict_write_real_ensemble():
                     'user_cos'] * user_cos_pred
         q.take_answers(predictions)
 
-        with open(f'data/outputs/{fname}.{infix}.txt', 'w+') as f:
-            f.write(str(q))
+        q.write_answers(f'data/outputs/{fname}.{infix}.txt')
 
 
 if __name__ == '__main__':
@@ -1,9 +1,18 @@
+from .artifact_cache import ArtifactCache, artifact_cache
+from .bundle import BUNDLE_VERSION, ModelBundle, read_bundle, write_bundle
 from .data_agg import aggregate_all, aggregate_cross_validation
-from .read_data import read_entries, read_split_entries, readall_train
+from .read_data import (
+    parse_entries,
+    read_entries,
+    read_split_entries,
+    readall_train,
+)
 from .utils import read_matrix, report_cf_test, write_matrix
 
 __all__ = [
-    'aggregate_all', 'aggregate_cross_validation', 'read_entries',
+    'ArtifactCache', 'artifact_cache', 'BUNDLE_VERSION', 'ModelBundle',
+    'read_bundle', 'write_bundle', 'aggregate_all',
+    'aggregate_cross_validation', 'parse_entries', 'read_entries',
     'read_split_entries', 'readall_train', 'read_matrix', 'report_cf_test',
     'write_matrix'
 ]
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import os
+from types import CodeType
+from typing import Any, Callable, Sequence
+
+import numpy as np
+
+from ..typing import HashableMatrix, matrix_digest
+from .bundle import read_bundle, write_bundle
+
+# Under the repository root rather than the working directory, so that every
+# entry point shares the cache.
+ARTIFACT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))), 'models', 'cache')
+ARTIFACT_MAX_BYTES = 1 << 32
+# Setting this environment variable to 0 bypasses the artifact cache.
+ARTIFACT_CACHE_ENV = 'CF_ARTIFACT_CACHE'
+# Bump when the matrices change in a way the fingerprints do not see (e.g. a
+# change in a function called by a similarity function), so that artifacts
+# written by older code are not loaded. Functions given as inputs are keyed by
+# their own code as well.
+ARTIFACT_VERSION = 1
+_SUFFIX = '.cfb'
+
+
+def _token(part: Any) -> str | None:
+    if isinstance(part, HashableMatrix):
+        return part.digest
+    elif isinstance(part, np.ma.MaskedArray):
+        return matrix_digest(np.ma.getdata(part)) + matrix_digest(
+            np.ma.getmaskarray(part))
+    elif isinstance(part, np.ndarray):
+        return matrix_digest(part)
+    elif isinstance(part, (tuple, list)):
+        tokens = [_token(item) for item in part]
+        if None in tokens:
+            return None
+        return f'({",".join(tokens)})'    # type: ignore
+    elif callable(part):
+        # Lambdas and closures have no identity that is stable across runs.
+        qualname = getattr(part, '__qualname__', '<unknown>')
+        if '<' in qualname:
+            return None
+        code = getattr(part, '__code__', None)
+        suffix = '' if code is None else f'#{_code_digest(code)}'
+        return f'{part.__module__}.{qualname}{suffix}'
+    return repr(part)
+
+
+def _code_digest(code: CodeType) -> str:
+    # Digest of the bytecode and constants of a function, so that editing it
+    # invalidates its artifacts. Nested code objects (e.g. comprehensions) are
+    # digested the same way, as their repr holds a memory address.
+    hasher = hashlib.blake2b(digest_size=8)
+    hasher.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            hasher.update(_code_digest(const).encode())
+        else:
+            hasher.update(repr(const).encode())
+        hasher.update(b'\0')
+    hasher.update(repr(code.co_names).encode())
+    return hasher.hexdigest()
+
+
+class ArtifactCache():
+    '''
+    Persistent cache of derived matrices (similarities, supports...), stored
+    as model bundles under directory and loaded through memmap. Keys are
+    fingerprints of the inputs the matrices are derived from.
+
+    When the bundles exceed max_bytes in total, the least recently used ones are
+    evicted. The cache is bypassed when enabled is false, which defaults to the
+    ARTIFACT_CACHE_ENV environment variable not being 0.
+    '''
+
+    def __init__(self,
+                 directory: str = ARTIFACT_DIR,
+                 max_bytes: int = ARTIFACT_MAX_BYTES,
+                 enabled: bool | None = None) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled if enabled is not None else os.environ.get(
+            ARTIFACT_CACHE_ENV, '1') != '0'
+
+    @staticmethod
+    def fingerprint(*parts: Any) -> str | None:
+        '''
+        Key of the given inputs: arrays by content, functions by qualified name
+        and code (but not the code of the functions they call, see
+        ARTIFACT_VERSION) and other values by repr. None if a part has no stable
+        identity, e.g. a lambda, in which case the artifact is not cached.
+        '''
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(f'{ARTIFACT_VERSION}'.encode())
+        for part in parts:
+            token = _token(part)
+            if token is None:
+                return None
+            hasher.update(token.encode() + b'\0')
+        return hasher.hexdigest()
+
+    def get_or_compute(
+        self, key: str | None, names: Sequence[str],
+        compute: Callable[[], Sequence[HashableMatrix]]
+    ) -> tuple[HashableMatrix, ...]:
+        '''
+        Matrices stored under key, in the order of names, or compute and store
+        them on a miss.
+        '''
+        if not self.enabled or key is None:
+            return tuple(compute())
+
+        path = os.path.join(self.directory, key + _SUFFIX)
+        if os.path.exists(path):
+            try:
+                bundle = read_bundle(path)
+                matrices = tuple(bundle.matrix(name) for name in names)
+                # Mark as recently used for the eviction.
+                os.utime(path)
+                return matrices
+            except (OSError, ValueError, KeyError):
+                # Unreadable or stale bundle, recompute it. Another process
+                # may have removed it already.
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+        matrices = tuple(compute())
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        write_bundle(tmp_path, dict(zip(names, matrices)), {'key': key})
+        os.replace(tmp_path, path)
+        self.evict()
+        return matrices
+
+    def evict(self) -> None:
+        '''
+        Remove the least recently used bundles until the cache fits in
+        max_bytes, always keeping the most recent one.
+        '''
+        if not os.path.isdir(self.directory):
+            return
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            total -= size
+
+    def clear(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(_SUFFIX):
+                os.remove(entry.path)
+
+
+artifact_cache = ArtifactCache()
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import struct
+from typing import TYPE_CHECKING, Any, Mapping
+
+import numpy as np
+
+from ..typing import HashableMatrix
+
+if TYPE_CHECKING:
+    from ..typing import IntArray
+
+# Layout: magic, format version and header length, then the JSON header and
+# the raw arrays in C order, each starting at a multiple of BUNDLE_ALIGN.
+BUNDLE_MAGIC = b'CFBUNDLE'
+BUNDLE_VERSION = 1
+BUNDLE_ALIGN = 64
+_PREAMBLE = struct.Struct('<8sII')
+# Suffix of the name of the array that stores the mask of a masked array.
+MASK_SUFFIX = '.mask'
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // BUNDLE_ALIGN) * BUNDLE_ALIGN
+
+
+def write_bundle(fname: str,
+                 arrays: Mapping[str, np.ndarray | HashableMatrix],
+                 meta: dict[str, Any] | None = None) -> None:
+    '''
+    Write named arrays (e.g. similarity, support, iuf, row_means, user_ids,
+    movie_ids) and JSON-serializable metadata into a single model bundle.
+    The mask of a masked array is stored as a boolean array of its own, named
+    after the array with MASK_SUFFIX.
+    '''
+    raws: dict[str, np.ndarray] = {}
+    for name, array in arrays.items():
+        raw = array.raw if isinstance(array, HashableMatrix) else array
+        if name.endswith(MASK_SUFFIX):
+            raise ValueError(f'array name {name} ends with {MASK_SUFFIX}.')
+        raws[name] = np.ascontiguousarray(np.ma.getdata(raw))
+        if isinstance(raw, np.ma.MaskedArray):
+            raws[name + MASK_SUFFIX] = np.ascontiguousarray(
+                np.ma.getmaskarray(raw))
+
+    # Array offsets are relative to the end of the (aligned) header, so that
+    # they do not depend on the header length.
+    entries: dict[str, dict[str, Any]] = {}
+    offset = 0
+    for name, raw in raws.items():
+        entries[name] = {
+            'dtype': raw.dtype.str,
+            'shape': list(raw.shape),
+            'offset': offset
+        }
+        offset = _aligned(offset + raw.nbytes)
+
+    header = json.dumps({'arrays': entries, 'meta': meta or {}}).encode()
+    data_start = _aligned(_PREAMBLE.size + len(header))
+
+    with open(fname, 'wb') as f:
+        f.write(_PREAMBLE.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(header)))
+        f.write(header)
+        for name, raw in raws.items():
+            f.seek(data_start + entries[name]['offset'])
+            f.write(raw.data)
+        f.truncate(data_start + offset)
+
+
+class ModelBundle():
+    '''
+    Model bundle opened with a single read-only memory map. Arrays are views of
+    the mapping, so loading neither parses nor copies them. Masked arrays are
+    rebuilt from their data and mask arrays.
+    '''
+
+    def __init__(self, fname: str) -> None:
+        self._mmap = np.memmap(fname, dtype=np.uint8, mode='r')
+        if self._mmap.size < _PREAMBLE.size:
+            raise ValueError(f'{fname} is not a model bundle.')
+
+        magic, version, header_len = _PREAMBLE.unpack(
+            self._mmap[:_PREAMBLE.size].tobytes())
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f'{fname} is not a model bundle.')
+        if version > BUNDLE_VERSION:
+            raise ValueError(
+                f'unsupported model bundle version {version} of {fname}.')
+
+        header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size +
+                                       header_len].tobytes())
+        data_start = _aligned(_PREAMBLE.size + header_len)
+
+        self.version: int = version
+        self.meta: dict[str, Any] = header['meta']
+        self.arrays: dict[str, np.ndarray] = {}
+        for name, entry in header['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            shape = tuple(entry['shape'])
+            start = data_start + entry['offset']
+            if start + dtype.itemsize * int(np.prod(shape)) > self._mmap.size:
+                raise ValueError(f'truncated model bundle {fname}.')
+            self.arrays[name] = np.ndarray(shape,
+                                           dtype=dtype,
+                                           buffer=self._mmap,
+                                           offset=start)
+
+        masks = [name for name in self.arrays if name.endswith(MASK_SUFFIX)]
+        for name in masks:
+            mask = self.arrays.pop(name)
+            data_name = name[:-len(MASK_SUFFIX)]
+            self.arrays[data_name] = np.ma.masked_array(self.arrays[data_name],
+                                                        mask=mask)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.arrays
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def matrix(self, name: str) -> HashableMatrix:
+        '''
+        Array as a Similarity/Support matrix.
+        '''
+        return HashableMatrix(self.arrays[name])
+
+    def user_indices(self, name: str = 'user_ids') -> dict[int, int]:
+        '''
+        Map of user ids to row indices, from the array of user ids by row.
+        '''
+        user_ids: IntArray = self.arrays[name]
+        return {int(user_id): i for i, user_id in enumerate(user_ids)}
+
+
+def read_bundle(fname: str) -> ModelBundle:
+    return ModelBundle(fname)
@@ -4,7 +4,7 @@ from typing import TYPE_CHECKING
 
 import numpy as np
 
-from ..typing import Questions, UserItemRatings, int_masked_matrix
+from ..typing import Questions, UserItemRatings, int_matrix
 
 if TYPE_CHECKING:
     from ..typing import EntryArray
@@ -32,18 +32,23 @@ def aggregate_ratings(
     col_num = shape[1] if shape and shape[1] else np.max(
         entry_arr[:, 1:2].flatten())
 
-    matrix = int_masked_matrix(True, (row_num, col_num))
+    rated = entry_arr[entry_arr[:, 2] != 0]
+    # Users are indexed in order of first appearance.
+    user_ids, first_inds, inverse = np.unique(rated[:, 0],
+                                              return_index=True,
+                                              return_inverse=True)
+    order = np.argsort(first_inds)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
 
-    user_indices = {}
-    index = 0
-    for user_id, movie_id, rating in entry_arr:
-        if rating != 0:
-            if not user_id in user_indices:
-                user_indices[user_id] = index
-                index += 1
-            matrix[user_indices[user_id], movie_id - 1] = rating
+    values = int_matrix((row_num, col_num))
+    mask = np.ones((row_num, col_num), dtype=bool)
+    rows, cols = ranks[inverse], rated[:, 1] - 1
+    values[rows, cols] = rated[:, 2]
+    mask[rows, cols] = False
 
-    return UserItemRatings(matrix, user_indices)
+    user_indices = dict(zip(user_ids[order].tolist(), range(len(order))))
+    return UserItemRatings(np.ma.masked_array(values, mask=mask), user_indices)
 
 
 def aggregate_questions(entry_arr: EntryArray,
@@ -91,15 +96,12 @@ def aggregate_cross_validation(
 def active_users_from_ratings(entry_arr: EntryArray,
                               ratings: UserItemRatings) -> UserItemRatings:
     '''
-    Build active user ratings from the existing ratings based on active user_ids.
+    Build active user ratings from the existing ratings based on active
+    user_ids.
     '''
     active_user_ids = np.unique(entry_arr[:, 0])
-
-    active_user_indices = {}
-    rows_to_take: list[int] = []
-    for user_id in active_user_ids:
-        index = ratings.ind_user_id(user_id)
-        active_user_indices[user_id] = len(rows_to_take)
-        rows_to_take.append(index)
+    rows_to_take = ratings.ind_user_id(active_user_ids)
+    active_user_indices = dict(
+        zip(active_user_ids.tolist(), range(len(active_user_ids))))
 
     return UserItemRatings(ratings.raw[rows_to_take], active_user_indices)
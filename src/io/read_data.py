@@ -1,32 +1,86 @@
 from __future__ import annotations
 
+import os
+import warnings
 from typing import TYPE_CHECKING
 
 import numpy as np
-import pandas as pd
 
+from .bundle import ModelBundle, write_bundle
 from .data_agg import aggregate_ratings
 
 if TYPE_CHECKING:
     from ..typing import EntryArray, UserItemRatings
 
-np.random.seed(0)
-
 TRAIN_FNAME = 'data/train.txt'
 
+# Parsed entry files are kept next to them in a model bundle, which is valid as
+# long as the size and mtime of the text file are unchanged.
+ENTRY_SIDECAR_SUFFIX = '.cfb'
+
+
+def parse_entries(fname: str) -> EntryArray:
+    '''
+    Parse a text file of space separated (user_id, movie_id, rating) lines.
+    '''
+    # np.fromfile stops at the first token that is not a number, with only a
+    # DeprecationWarning on older NumPy versions (a ValueError on newer ones).
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            entries = np.fromfile(fname, dtype=np.int32, sep=' ')
+        except (DeprecationWarning, ValueError) as exc:
+            raise ValueError(
+                f'{fname} is not a file of rating entries.') from exc
+    if entries.size % 3 != 0:
+        raise ValueError(f'{fname} is not a file of rating entries.')
+    return entries.reshape(-1, 3)
+
+
+def read_entries(fname: str, sidecar: bool = True) -> EntryArray:
+    '''
+    Read an entry file. The parsed entries are cached in a sidecar file, so
+    that later reads of an unchanged file are memory maps of the binary array
+    instead of text parsing. The returned array is read-only.
+    '''
+    if not sidecar:
+        return parse_entries(fname)
+
+    stat = os.stat(fname)
+    source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    sidecar_fname = fname + ENTRY_SIDECAR_SUFFIX
+    try:
+        bundle = ModelBundle(sidecar_fname)
+        if bundle.meta.get('source') == source:
+            return bundle['entries']
+    except (OSError, ValueError, KeyError):
+        pass
 
-def read_entries(fname: str) -> EntryArray:
-    return pd.read_csv(fname, delimiter=' ', header=None) \
-             .to_numpy(dtype=np.int32)
+    entries = parse_entries(fname)
+    tmp_fname = f'{sidecar_fname}.{os.getpid()}.tmp'
+    try:
+        write_bundle(tmp_fname, {'entries': entries}, {'source': source})
+        os.replace(tmp_fname, sidecar_fname)
+    except OSError:
+        # Read-only location, go without the sidecar.
+        pass
+    finally:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+    entries.setflags(write=False)
+    return entries
 
 
-def read_split_entries(test_size: float) -> tuple[EntryArray, EntryArray]:
+def read_split_entries(test_size: float,
+                       seed: int = 0) -> tuple[EntryArray, EntryArray]:
     '''
-    Returns a tuple of entry arrays (train, test), derived from the raw training 
-    data for cross validation.
+    Returns a tuple of entry arrays (train, test), derived from the raw
+    training data for cross validation. The split only depends on seed, not on
+    earlier draws of the global random state.
     '''
-    entry_arr = read_entries(TRAIN_FNAME)
-    np.random.shuffle(entry_arr)
+    # A shuffled copy, entry files are read-only.
+    entry_arr = np.random.default_rng(seed).permutation(
+        read_entries(TRAIN_FNAME))
 
     if test_size < 1:
         bound = int(entry_arr.shape[0] * test_size)
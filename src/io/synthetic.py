@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from statistics import NormalDist
+from typing import TYPE_CHECKING, Iterator, TextIO
+
+import numpy as np
+
+from ..typing import NpInt
+
+if TYPE_CHECKING:
+    from ..typing import BoolArray, EntryArray, FloatArray, IntArray
+
+# Share of the ratings 1 to 5 in data/train.txt.
+RATING_DISTRIBUTION = (0.067, 0.106, 0.249, 0.339, 0.243)
+# Exponents of the power laws of user activity and item popularity: the weight
+# of the rank-th most active user (or popular item) is rank ** -exponent.
+ACTIVITY_EXPONENT = 0.8
+POPULARITY_EXPONENT = 1.0
+# Fewest ratings of a user, like the smallest task files.
+MIN_USER_RATINGS = 5
+# Users generated together. Every block has its own random stream, so that the
+# output depends on the seed only, and at most one block is held in memory.
+SYNTHETIC_BLOCK_USERS = 4096
+
+# Task files written by default, as (file name, given ratings per user), like
+# data/task.
+SYNTHETIC_TASKS = (('test5', 5), ('test10', 10), ('test20', 20))
+
+# Random streams of the model, the training users and the task users.
+_MODEL, _TRAIN, _TASK = range(3)
+# Standard deviations of the user bias and the item quality in the latent score
+# of a rating; the rest of its unit variance is noise.
+_USER_BIAS_SD = 0.5
+_ITEM_QUALITY_SD = 0.5
+# Rounds of sampling items with replacement before a user's missing items are
+# sampled without replacement.
+_SAMPLING_ROUNDS = 8
+
+
+def format_entries(entries: EntryArray) -> str:
+    '''
+    Lines of space separated (user_id, movie_id, rating) of an entry array.
+    '''
+    return ('%d %d %d\n' * len(entries)) % tuple(entries.ravel().tolist())
+
+
+def _power_law(n: int, exponent: float, rng: np.random.Generator) -> FloatArray:
+    # Normalized power law weights, in a random order.
+    weights = np.arange(1, n + 1, dtype=np.float64)**-exponent
+    return rng.permutation(weights / weights.sum())
+
+
+def _merge_keys(keys: IntArray, new: IntArray) -> IntArray:
+    # Sorted union of sorted keys and new keys; np.union1d hashes, which is
+    # much slower on large blocks.
+    merged = np.sort(np.concatenate((keys, new)))
+    return merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+
+
+class SyntheticRatings():
+    '''
+    Seeded generator of rating data with power-law user activity and item
+    popularity, written as entry files without holding them in memory.
+
+    Users rate about users * items * density items in total, shared by a power
+    law over the users (at least MIN_USER_RATINGS and at most all the items
+    each). Items are drawn by a power law of popularity. A rating comes from a
+    latent score (user bias + item quality + noise) cut at the quantiles of
+    rating_distribution, so that the ratings follow it overall.
+    '''
+
+    def __init__(self,
+                 users: int,
+                 items: int,
+                 density: float,
+                 seed: int = 0,
+                 activity_exponent: float = ACTIVITY_EXPONENT,
+                 popularity_exponent: float = POPULARITY_EXPONENT,
+                 rating_distribution: tuple[float, ...] = RATING_DISTRIBUTION):
+        self.users = users
+        self.items = items
+        self.density = density
+        self.seed = seed
+        self.activity_exponent = activity_exponent
+
+        rng = self._rng(_MODEL)
+        self._popularity = np.cumsum(_power_law(items, popularity_exponent,
+                                                rng))
+        self._log_popularity = np.log(np.diff(self._popularity, prepend=0))
+        self._item_quality = rng.normal(0, _ITEM_QUALITY_SD, items)
+        cumulative = np.cumsum(rating_distribution) / np.sum(
+            rating_distribution)
+        self._thresholds = np.array(
+            [NormalDist().inv_cdf(p) for p in cumulative[:-1]])
+
+        self._train_counts = self._user_counts(users, _TRAIN)
+
+    def _rng(self, *stream: int) -> np.random.Generator:
+        return np.random.default_rng([self.seed, *stream])
+
+    def _user_counts(self, users: int, *stream: int) -> IntArray:
+        activity = _power_law(users, self.activity_exponent, self._rng(*stream))
+        counts = np.round(activity * users * self.items * self.density)
+        return np.clip(counts, MIN_USER_RATINGS, self.items).astype(NpInt)
+
+    def _sample_items(self, counts: IntArray,
+                      rng: np.random.Generator) -> tuple[IntArray, IntArray]:
+        '''
+        Distinct items of every user (counts[u] of them, by popularity), as
+        parallel arrays of user indices and item indices sorted by both.
+        '''
+        keys = np.empty(0, dtype=np.int64)
+        need = counts.astype(np.int64)
+        for _ in range(_SAMPLING_ROUNDS):
+            if not need.any():
+                break
+            users = np.repeat(np.arange(len(counts)), need)
+            items = np.searchsorted(
+                self._popularity,
+                rng.random(len(users)) * self._popularity[-1])
+            keys = _merge_keys(
+                keys, users * self.items + np.minimum(items, self.items - 1))
+            need = counts - np.bincount(keys // self.items,
+                                        minlength=len(counts))
+
+        # Users that still miss items (the most active ones) draw them without
+        # replacement among the ones they do not have: the top need of their
+        # log popularity plus Gumbel noise.
+        starts = np.searchsorted(keys, np.arange(len(counts) + 1) * self.items)
+        extra = []
+        for user in np.flatnonzero(need):
+            scores = self._log_popularity - np.log(
+                -np.log(rng.random(self.items)))
+            scores[keys[starts[user]:starts[user + 1]] % self.items] = -np.inf
+            top = np.argpartition(scores, -need[user])[-need[user]:]
+            extra.append(user * self.items + top)
+        if extra:
+            keys = _merge_keys(keys, np.concatenate(extra))
+
+        return keys // self.items, keys % self.items
+
+    def _ratings(self, user_bias: FloatArray, items: IntArray,
+                 rng: np.random.Generator) -> IntArray:
+        noise_sd = np.sqrt(1 - _USER_BIAS_SD**2 - _ITEM_QUALITY_SD**2)
+        scores = user_bias + self._item_quality[items] + rng.normal(
+            0, noise_sd, len(items))
+        return (np.searchsorted(self._thresholds, scores) + 1).astype(NpInt)
+
+    def _blocks(
+            self, counts: IntArray, first_id: int,
+            *stream: int) -> Iterator[tuple[EntryArray, np.random.Generator]]:
+        '''
+        Entries of the users with counts, SYNTHETIC_BLOCK_USERS users at a time,
+        sorted by user id (from first_id) and movie id, with the random stream
+        of the block.
+        '''
+        for block, start in enumerate(
+                range(0, len(counts), SYNTHETIC_BLOCK_USERS)):
+            rng = self._rng(*stream, block)
+            block_counts = counts[start:start + SYNTHETIC_BLOCK_USERS]
+            users, items = self._sample_items(block_counts, rng)
+            user_bias = rng.normal(0, _USER_BIAS_SD, len(block_counts))
+            ratings = self._ratings(user_bias[users], items, rng)
+            yield np.column_stack((users + start + first_id, items + 1,
+                                   ratings)).astype(NpInt), rng
+
+    def train_entries(self) -> Iterator[EntryArray]:
+        '''
+        Blocks of the training entries, of user ids 1 to users.
+        '''
+        for entries, _ in self._blocks(self._train_counts, 1, _TRAIN):
+            yield entries
+
+    def entries(self) -> EntryArray:
+        '''
+        All the training entries at once, for datasets that fit in memory.
+        '''
+        return np.concatenate(list(self.train_entries()))
+
+    def task_entries(self,
+                     users: int,
+                     given: int,
+                     first_id: int | None = None,
+                     stream: int = 0) -> Iterator[tuple[EntryArray, BoolArray]]:
+        '''
+        Blocks of the entries of a task file of new users (from first_id, after
+        the training users by default), and the mask of the given ones: given
+        random ratings of every user, then its other ratings (the questions),
+        each sorted by movie id. Questions keep their rating.
+
+        stream: distinguishes the users of different task files.
+        '''
+        first_id = self.users + 1 if first_id is None else first_id
+        counts = self._user_counts(users, _TASK, stream)
+        counts = np.clip(counts, given + 1, self.items)
+        for entries, rng in self._blocks(counts, first_id, _TASK, stream):
+            user_ids = entries[:, 0]
+            # Users in a random order of their entries, and the rank of every
+            # entry in it.
+            order = np.lexsort((rng.random(len(entries)), user_ids))
+            starts = np.searchsorted(user_ids, user_ids)
+            is_given = np.empty(len(entries), dtype=bool)
+            is_given[order] = np.arange(len(entries)) - starts[order] < given
+
+            order = np.lexsort((entries[:, 1], ~is_given, user_ids))
+            yield entries[order], is_given[order]
+
+    def write_train(self, fname: str) -> None:
+        '''
+        Write the training entries, like data/train.txt.
+        '''
+        with open(fname, 'w') as f:
+            for block in self.train_entries():
+                f.write(format_entries(block))
+
+    def write_task(self,
+                   fname: str,
+                   users: int,
+                   given: int,
+                   answers_fname: str | None = None,
+                   first_id: int | None = None,
+                   stream: int = 0) -> None:
+        '''
+        Write a task file like data/task/test*.txt: given rated lines of every
+        user, then its questions with rating 0. With answers_fname, the
+        questions are also written there with their ratings, for evaluation.
+        '''
+        answers: TextIO | None = open(answers_fname,
+                                      'w') if answers_fname else None
+        try:
+            with open(fname, 'w') as f:
+                for entries, is_given in self.task_entries(
+                        users, given, first_id, stream):
+                    if answers is not None:
+                        answers.write(format_entries(entries[~is_given]))
+                    entries[~is_given, 2] = 0
+                    f.write(format_entries(entries))
+        finally:
+            if answers is not None:
+                answers.close()
+
+
+def write_dataset(out_dir: str,
+                  ratings: SyntheticRatings,
+                  task_users: int = 100,
+                  tasks: tuple[tuple[str, int], ...] = SYNTHETIC_TASKS) -> None:
+    '''
+    Write train.txt and the task files (with their answers) of ratings into
+    out_dir. Task users follow the training users, and the users of the previous
+    task, like the ids of data/task.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    ratings.write_train(os.path.join(out_dir, 'train.txt'))
+    for stream, (name, given) in enumerate(tasks):
+        ratings.write_task(os.path.join(out_dir, f'{name}.txt'),
+                           task_users,
+                           given,
+                           os.path.join(out_dir, f'{name}.answers.txt'),
+                           first_id=ratings.users + stream * task_users + 1,
+                           stream=stream)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic training file and task files.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--density', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--task-users',
+                        type=int,
+                        default=100,
+                        help='users of every task file, none if 0')
+    parser.add_argument('--activity-exponent',
+                        type=float,
+                        default=ACTIVITY_EXPONENT)
+    parser.add_argument('--popularity-exponent',
+                        type=float,
+                        default=POPULARITY_EXPONENT)
+    args = parser.parse_args(argv)
+
+    ratings = SyntheticRatings(args.users, args.items, args.density, args.seed,
+                               args.activity_exponent, args.popularity_exponent)
+    write_dataset(args.out_dir, ratings, args.task_users,
+                  SYNTHETIC_TASKS if args.task_users > 0 else ())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
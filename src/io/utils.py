@@ -2,8 +2,6 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-import pandas as pd
-
 from ..typing import HashableMatrix, NpFloat
 
 if TYPE_CHECKING:
@@ -18,6 +16,9 @@ def report_cf_test(method: str, conf: Config, mae: float):
 
 
 def write_matrix(fname: str, matrix: HashableMatrix | FloatMatrix) -> None:
+    # pandas is slow to import and only needed for CSV matrices.
+    import pandas as pd
+
     if isinstance(matrix, HashableMatrix):
         df = pd.DataFrame(matrix.raw)
     else:
@@ -26,5 +27,7 @@ def write_matrix(fname: str, matrix: HashableMatrix | FloatMatrix) -> None:
 
 
 def read_matrix(fname: str) -> HashableMatrix:
+    import pandas as pd
+
     matrix = pd.read_csv(fname, header=None).to_numpy(NpFloat)
     return HashableMatrix(matrix)
@@ -1,5 +1,5 @@
 from .core.cf import similarity_matrix
-from .core.train import train_cf
+from .core.train import train_cf_k
 from .io import (
     aggregate_all,
     aggregate_cross_validation,
@@ -113,14 +113,10 @@ def dump_sim():
 def train():
     train_arr, test_arr = read_split_entries(0.05)
     r, a, q = aggregate_cross_validation(train_arr, test_arr)
-    conf_list = []
-    for k in range(1, 50):
-        conf = (presets['corr'] + {
-            'knn_k': k
-        }) * dynamic_presets['case_amp'](2.5) + dynamic_presets['iuf'](r.raw)
-        conf_list.append(conf)
-    print(conf_list[0])
-    train_cf(r, a, q, user_based_cf, conf_list)
+    conf = presets['corr'] * dynamic_presets['case_amp'](
+        2.5) + dynamic_presets['iuf'](r.raw)
+    print(conf)
+    train_cf_k(r, a, q, user_based_cf, conf, list(range(1, 50)))
 
 
 def make_uvi5_extend():
@@ -2,20 +2,55 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
+import numpy as np
+
 from ..core.cf import indexed_desc_similarity, similarity_matrix
-from ..typing import float_array
+from ..core.cf.prediction import (
+    BATCH_SIZE,
+    batch_predict,
+    batch_sweep,
+    is_batched,
+    question_ks,
+)
+from ..core.cf.similarity_selection import (
+    map_neighbor_weights,
+    stack_top_k_neighbors,
+)
+from ..core.shared.parallel import chunk_map
+from ..typing import float_array, float_type
 
 if TYPE_CHECKING:
     from ..config import Config
-    from ..typing import PredictionArray, Questions, Similarity, UserItemRatings
+    from ..typing import (
+        FloatMatrix,
+        IntArray,
+        IntMatrix,
+        NeighborGraph,
+        PredictionArray,
+        Questions,
+        Similarity,
+        UserItemRatings,
+    )
 
 
 def item_based_cf(ratings: UserItemRatings,
                   active_ratings: UserItemRatings,
                   questions: Questions,
                   config: Config,
-                  item_similarity: Similarity | None = None) -> PredictionArray:
-    if item_similarity is None:
+                  item_similarity: Similarity | None = None,
+                  item_graph: NeighborGraph | None = None,
+                  k_range: IntArray | None = None,
+                  workers: int | None = 1,
+                  chunk_size: int = BATCH_SIZE) -> PredictionArray:
+    '''
+    item_graph: pruned item similarity (see knn_graph). When given, neighbors
+        are taken from the graph and the full item similarity is not needed.
+    k_range: predict for every k of k_range at once, ignoring config.knn_k, and
+        return a (len(k_range), questions) matrix (see batch_sweep).
+    workers: threads that predict the questions, chunk_size questions at a
+        time, one per core if None (see chunk_map).
+    '''
+    if item_similarity is None and item_graph is None:
         item_similarity = similarity_matrix(ratings.raw.T,
                                             ratings.raw.T,
                                             config.sim_scheme,
@@ -24,24 +59,71 @@ def item_based_cf(ratings: UserItemRatings,
 
     # In real world, active users do not come together at once. But for the sake
     # of this project, we batch and stack them with the training ratings.
-    stacked_ratings = ratings + active_ratings
+    stacked_ratings = ratings.stack(active_ratings)
+
+    if k_range is not None and not is_batched(config.prediction):
+        raise ValueError('k sweep requires a batched prediction function.')
+
+    if is_batched(config.prediction):
+        user_inds = stacked_ratings.ind_user_id(questions.raw[:, 0])
+        movie_inds = stacked_ratings.ind_movie_id(questions.raw[:, 1])
+        ks = question_ks(
+            config.knn_k if k_range is None else int(np.max(k_range)),
+            user_inds, stacked_ratings.raw)
+
+        def neighbors(batch: slice) -> tuple[IntMatrix, FloatMatrix]:
+            if item_graph is not None:
+                rows = item_graph.neighbors[movie_inds[batch]]
+                weights = item_graph.weights[movie_inds[batch]].astype(
+                    float_type())
+                return rows, map_neighbor_weights(config.indexed_sim_map, rows,
+                                                  weights)
+            return stack_top_k_neighbors(movie_inds[batch],
+                                         user_inds[batch],
+                                         ks[batch],
+                                         stacked_ratings.raw.T,
+                                         item_similarity,
+                                         config.pre_sort_sim,
+                                         map_func=config.indexed_sim_map)
+
+        active_users = lambda batch: stacked_ratings.raw[user_inds[batch]]
+        if k_range is not None:
+            return batch_sweep(config.prediction, k_range, user_inds,
+                               movie_inds, stacked_ratings.raw.T, active_users,
+                               neighbors, chunk_size, workers)
+        return batch_predict(config.prediction, ks, user_inds, movie_inds,
+                             stacked_ratings.raw.T, active_users, neighbors,
+                             chunk_size, workers)
+
     predictions = float_array(questions.raw.shape[0])
-    for i, (user_id, movie_id, _) in enumerate(questions.raw):
-        movie_ind = stacked_ratings.ind_movie_id(movie_id)
-        user_ind = stacked_ratings.ind_user_id(user_id)
 
-        item_desc_sim = indexed_desc_similarity(movie_ind,
-                                                item_similarity,
-                                                config.pre_sort_sim,
-                                                map_func=config.indexed_sim_map)
+    def predict_chunk(chunk: slice) -> None:
+        for i, (user_id, movie_id, _) in enumerate(questions.raw[chunk],
+                                                   chunk.start):
+            movie_ind = stacked_ratings.ind_movie_id(movie_id)
+            user_ind = stacked_ratings.ind_user_id(user_id)
+
+            if item_graph is not None:
+                item_desc_sim = item_graph.indexed(movie_ind)
+                if config.indexed_sim_map is not None:
+                    item_desc_sim = config.indexed_sim_map(item_desc_sim)
+            else:
+                item_desc_sim = indexed_desc_similarity(
+                    movie_ind,
+                    item_similarity,
+                    config.pre_sort_sim,
+                    map_func=config.indexed_sim_map)
 
-        active_user = stacked_ratings[user_id]
-        if callable(config.knn_k):
-            k = config.knn_k(active_user)
-        else:
-            k = config.knn_k
+            active_user = stacked_ratings[user_id]
+            if callable(config.knn_k):
+                k = config.knn_k(active_user)
+            else:
+                k = config.knn_k
 
-        predictions[i] = config.prediction(k, user_ind, movie_ind, active_user,
-                                           stacked_ratings.raw.T, item_desc_sim)
+            predictions[i] = config.prediction(k, user_ind, movie_ind,
+                                               active_user,
+                                               stacked_ratings.raw.T,
+                                               item_desc_sim)
 
+    chunk_map(predict_chunk, len(questions.raw), chunk_size, workers)
     return predictions
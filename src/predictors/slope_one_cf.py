@@ -2,12 +2,25 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-from ..core.cf import indexed_support, similarity_matrix, support_matrix
-from ..typing import float_array
+import numpy as np
+
+from ..core.cf import (
+    difference_support_matrix,
+    indexed_support,
+    similarity_matrix,
+    support_matrix,
+)
+from ..core.cf.funcs.similarity_func import average_difference_matrix
+from ..core.cf.prediction import BATCH_SIZE, batch_predict, is_batched
+from ..core.cf.similarity_selection import stack_indexed_sims
+from ..core.shared.parallel import chunk_map
+from ..typing import NpInt, float_array
 
 if TYPE_CHECKING:
     from ..config import Config
     from ..typing import (
+        FloatMatrix,
+        IntMatrix,
         PredictionArray,
         Questions,
         Similarity,
@@ -21,7 +34,22 @@ def slope_one_cf(ratings: UserItemRatings,
                  questions: Questions,
                  config: Config,
                  item_diff: Similarity | None = None,
-                 item_diff_sup: Support | None = None) -> PredictionArray:
+                 item_diff_sup: Support | None = None,
+                 workers: int | None = 1,
+                 chunk_size: int = BATCH_SIZE) -> PredictionArray:
+    '''
+    workers: threads that predict the questions, chunk_size questions at a
+        time, one per core if None (see chunk_map).
+    '''
+    if (item_diff is None and item_diff_sup is None
+            and config.sim_scheme is average_difference_matrix):
+        # Both come from the same co-rating counts.
+        item_diff, item_diff_sup = difference_support_matrix(
+            ratings.raw.T,
+            ratings.raw.T,
+            config.sim_fill_value,
+            weights=config.sim_weights)
+
     if item_diff is None:
         item_diff = similarity_matrix(ratings.raw.T,
                                       ratings.raw.T,
@@ -34,20 +62,41 @@ def slope_one_cf(ratings: UserItemRatings,
 
     # In real world, active users do not come together at once. But for the sake
     # of this project, we batch and stack them with the training ratings.
-    stacked_ratings = ratings + active_ratings
+    stacked_ratings = ratings.stack(active_ratings)
+
+    if is_batched(config.prediction):
+        user_inds = stacked_ratings.ind_user_id(questions.raw[:, 0])
+        movie_inds = stacked_ratings.ind_movie_id(questions.raw[:, 1])
+
+        # Not a knn CF, use a negative k to take all the neighbors.
+        ks = np.full(len(user_inds), -1, dtype=NpInt)
+
+        def neighbors(batch: slice) -> tuple[IntMatrix, FloatMatrix]:
+            return stack_indexed_sims(
+                movie_inds[batch],
+                lambda row: indexed_support(row, item_diff_sup))
+
+        active_users = lambda batch: (stacked_ratings.raw[user_inds[batch]] -
+                                      item_diff.raw[:, movie_inds[batch]].T)
+        return batch_predict(config.prediction, ks, user_inds, movie_inds,
+                             stacked_ratings.raw.T, active_users, neighbors,
+                             chunk_size, workers)
+
     predictions = float_array(questions.raw.shape[0])
-    for i, (user_id, movie_id, _) in enumerate(questions.raw):
-        user_ind = stacked_ratings.ind_user_id(user_id)
-        movie_ind = stacked_ratings.ind_movie_id(movie_id)
 
-        indexed_sup = indexed_support(movie_ind, item_diff_sup)
+    def predict_chunk(chunk: slice) -> None:
+        for i, (user_id, movie_id, _) in enumerate(questions.raw[chunk],
+                                                   chunk.start):
+            user_ind = stacked_ratings.ind_user_id(user_id)
+            movie_ind = stacked_ratings.ind_movie_id(movie_id)
+
+            indexed_sup = indexed_support(movie_ind, item_diff_sup)
 
-        predictions[i] = config.prediction(
-            -1,    # Not a knn CF, use a negative value to escape k == 0 check
-            user_ind,
-            movie_ind,
-            stacked_ratings[user_id] - item_diff.raw[:, movie_ind],
-            stacked_ratings.raw.T,
-            indexed_sup)
+            # Not a knn CF, use a negative value to escape k == 0 check.
+            predictions[i] = config.prediction(
+                -1, user_ind, movie_ind,
+                stacked_ratings[user_id] - item_diff.raw[:, movie_ind],
+                stacked_ratings.raw.T, indexed_sup)
 
+    chunk_map(predict_chunk, len(questions.raw), chunk_size, workers)
     return predictions
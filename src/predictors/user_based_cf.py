@@ -2,20 +2,56 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
+import numpy as np
+
 from ..core.cf import indexed_desc_similarity, similarity_matrix
-from ..typing import float_array
+from ..core.cf.prediction import (
+    BATCH_SIZE,
+    batch_predict,
+    batch_sweep,
+    is_batched,
+    question_ks,
+)
+from ..core.cf.similarity_selection import (
+    map_neighbor_weights,
+    stack_top_k_neighbors,
+)
+from ..core.shared.parallel import chunk_map
+from ..typing import float_array, float_type
 
 if TYPE_CHECKING:
     from ..config import Config
-    from ..typing import PredictionArray, Questions, Similarity, UserItemRatings
+    from ..typing import (
+        FloatMatrix,
+        IntArray,
+        IntMatrix,
+        NeighborGraph,
+        PredictionArray,
+        Questions,
+        Similarity,
+        UserItemRatings,
+    )
 
 
 def user_based_cf(ratings: UserItemRatings,
                   active_ratings: UserItemRatings,
                   questions: Questions,
                   config: Config,
-                  user_similarity: Similarity | None = None) -> PredictionArray:
-    if user_similarity is None:
+                  user_similarity: Similarity | None = None,
+                  user_graph: NeighborGraph | None = None,
+                  k_range: IntArray | None = None,
+                  workers: int | None = 1,
+                  chunk_size: int = BATCH_SIZE) -> PredictionArray:
+    '''
+    user_graph: pruned user similarity of the active users (see knn_graph and
+        approximate_knn_graph). When given, neighbors are taken from the graph
+        and the full user similarity is not needed.
+    k_range: predict for every k of k_range at once, ignoring config.knn_k, and
+        return a (len(k_range), questions) matrix (see batch_sweep).
+    workers: threads that predict the questions, chunk_size questions at a
+        time, one per core if None (see chunk_map).
+    '''
+    if user_similarity is None and user_graph is None:
         user_similarity = similarity_matrix(active_ratings.raw,
                                             ratings.raw,
                                             config.sim_scheme,
@@ -24,26 +60,75 @@ def user_based_cf(ratings: UserItemRatings,
 
     # In real world, active users do not come together at once. But for the sake
     # of this project, we batch and stack them with the training ratings.
-    stacked_ratings = ratings + active_ratings
-    predictions = float_array(questions.raw.shape[0])
-    for i, (user_id, movie_id, _) in enumerate(questions.raw):
-        movie_ind = stacked_ratings.ind_movie_id(movie_id)
-        user_ind = stacked_ratings.ind_user_id(user_id)
+    stacked_ratings = ratings.stack(active_ratings)
+
+    if k_range is not None and not is_batched(config.prediction):
+        raise ValueError('k sweep requires a batched prediction function.')
 
-        user_desc_sim = indexed_desc_similarity(
+    if is_batched(config.prediction):
+        user_ids, movie_ids = questions.raw[:, 0], questions.raw[:, 1]
+        user_inds = stacked_ratings.ind_user_id(user_ids)
+        movie_inds = stacked_ratings.ind_movie_id(movie_ids)
+        ks = question_ks(
+            config.knn_k if k_range is None else int(np.max(k_range)),
+            user_inds, stacked_ratings.raw)
         # User similarity matrix is indexed by active users.
-            active_ratings.ind_user_id(user_id),
-            user_similarity,
-            config.pre_sort_sim,
-            map_func=config.indexed_sim_map)
+        sim_rows = active_ratings.ind_user_id(user_ids)
+
+        def neighbors(batch: slice) -> tuple[IntMatrix, FloatMatrix]:
+            if user_graph is not None:
+                rows = user_graph.neighbors[sim_rows[batch]]
+                weights = user_graph.weights[sim_rows[batch]].astype(
+                    float_type())
+                return rows, map_neighbor_weights(config.indexed_sim_map, rows,
+                                                  weights)
+            return stack_top_k_neighbors(sim_rows[batch],
+                                         movie_inds[batch],
+                                         ks[batch],
+                                         stacked_ratings.raw,
+                                         user_similarity,
+                                         config.pre_sort_sim,
+                                         map_func=config.indexed_sim_map)
+
+        active_users = lambda batch: stacked_ratings.raw[user_inds[batch]]
+        if k_range is not None:
+            return batch_sweep(config.prediction, k_range, movie_inds,
+                               user_inds, stacked_ratings.raw, active_users,
+                               neighbors, chunk_size, workers)
+        return batch_predict(config.prediction, ks, movie_inds, user_inds,
+                             stacked_ratings.raw, active_users, neighbors,
+                             chunk_size, workers)
+
+    predictions = float_array(questions.raw.shape[0])
+
+    def predict_chunk(chunk: slice) -> None:
+        for i, (user_id, movie_id, _) in enumerate(questions.raw[chunk],
+                                                   chunk.start):
+            movie_ind = stacked_ratings.ind_movie_id(movie_id)
+            user_ind = stacked_ratings.ind_user_id(user_id)
+
+            # User similarity matrix is indexed by active users.
+            sim_row = active_ratings.ind_user_id(user_id)
+            if user_graph is not None:
+                user_desc_sim = user_graph.indexed(sim_row)
+                if config.indexed_sim_map is not None:
+                    user_desc_sim = config.indexed_sim_map(user_desc_sim)
+            else:
+                user_desc_sim = indexed_desc_similarity(
+                    sim_row,
+                    user_similarity,
+                    config.pre_sort_sim,
+                    map_func=config.indexed_sim_map)
 
-        active_user = stacked_ratings[user_id]
-        if callable(config.knn_k):
-            k = config.knn_k(active_user)
-        else:
-            k = config.knn_k
+            active_user = stacked_ratings[user_id]
+            if callable(config.knn_k):
+                k = config.knn_k(active_user)
+            else:
+                k = config.knn_k
 
-        predictions[i] = config.prediction(k, movie_ind, user_ind, active_user,
-                                           stacked_ratings.raw, user_desc_sim)
+            predictions[i] = config.prediction(k, movie_ind, user_ind,
+                                               active_user, stacked_ratings.raw,
+                                               user_desc_sim)
 
+    chunk_map(predict_chunk, len(questions.raw), chunk_size, workers)
     return predictions
@@ -1,12 +1,18 @@
 from .nparray_builder import (
     float_array,
     float_matrix,
+    float_type,
     int_array,
     int_masked_array,
     int_masked_matrix,
     int_matrix,
+    precision,
+    set_precision,
 )
 from .type_aliases import (
+    BoolArray,
+    BoolMatrix,
+    CompactFloatMatrix,
     EntryArray,
     FDynamicK,
     FIndexedSimMap,
@@ -14,6 +20,7 @@ from .type_aliases import (
     FloatMaskedArray,
     FloatMaskedMatrix,
     FloatMatrix,
+    FNeighborTerms,
     FPrediction,
     FPreSortSim,
     FSimilarity,
@@ -23,6 +30,8 @@ from .type_aliases import (
     IntMaskedMatrix,
     IntMatrix,
     NanSimilarityMatrix,
+    NeighborTerms,
+    NpCompactFloat,
     NpFloat,
     NpInt,
     PredictionArray,
@@ -32,19 +41,28 @@ from .type_aliases import (
 )
 from .wrapper_types import (
     HashableMatrix,
+    NeighborGraph,
     Questions,
     Similarity,
+    StackedMatrix,
     Support,
     UserItemRatings,
+    matrix_digest,
 )
 
 __all__ = [
     'float_array',
     'float_matrix',
+    'float_type',
     'int_array',
     'int_masked_array',
     'int_masked_matrix',
     'int_matrix',
+    'precision',
+    'set_precision',
+    'BoolArray',
+    'BoolMatrix',
+    'CompactFloatMatrix',
     'EntryArray',
     'FDynamicK',
     'FIndexedSimMap',
@@ -52,6 +70,7 @@ __all__ = [
     'FloatMaskedArray',
     'FloatMaskedMatrix',
     'FloatMatrix',
+    'FNeighborTerms',
     'FPrediction',
     'FPreSortSim',
     'FSimilarity',
@@ -61,6 +80,8 @@ __all__ = [
     'IntMaskedMatrix',
     'IntMatrix',
     'NanSimilarityMatrix',
+    'NeighborTerms',
+    'NpCompactFloat',
     'NpFloat',
     'NpInt',
     'PredictionArray',
@@ -68,8 +89,11 @@ __all__ = [
     'SimilarityMatrix',
     'SupportMatrix',
     'HashableMatrix',
+    'NeighborGraph',
     'Questions',
     'Similarity',
+    'StackedMatrix',
     'Support',
     'UserItemRatings',
+    'matrix_digest',
 ]
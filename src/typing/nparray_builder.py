@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator
 
 import numpy as np
 
@@ -18,6 +19,37 @@ if TYPE_CHECKING:
         IntMatrix,
     )
 
+# Float type of the similarity, support and prediction arrays. float32 halves
+# their memory and bandwidth; sums over many terms still accumulate in NpFloat.
+_precision: list[type[np.floating]] = [NpFloat]
+
+
+def float_type() -> type[np.floating]:
+    return _precision[0]
+
+
+def set_precision(dtype: type[np.floating]) -> None:
+    '''
+    Set the float type (np.float64 or np.float32) of the arrays built from now
+    on. Arrays built before keep their type.
+    '''
+    if dtype not in (np.float64, np.float32):
+        raise ValueError(f'unsupported precision {dtype}.')
+    _precision[0] = dtype
+
+
+@contextmanager
+def precision(dtype: type[np.floating]) -> Iterator[None]:
+    '''
+    set_precision for the duration of a with block.
+    '''
+    previous = float_type()
+    set_precision(dtype)
+    try:
+        yield
+    finally:
+        set_precision(previous)
+
 
 def int_array(len_or_val: int | np.int_ | list[int] | IntArray) -> IntArray:
     if isinstance(len_or_val, int):
@@ -39,9 +71,9 @@ def int_matrix(
 def float_array(
         len_or_val: int | np.int_ | list[float] | FloatArray) -> FloatArray:
     if isinstance(len_or_val, int):
-        return np.zeros(len_or_val, dtype=NpFloat)
+        return np.zeros(len_or_val, dtype=float_type())
     else:
-        return np.array(len_or_val, dtype=NpFloat)
+        return np.array(len_or_val, dtype=float_type())
 
 
 def float_matrix(
@@ -49,9 +81,9 @@ def float_matrix(
     FloatMatrix
 ) -> FloatMatrix:
     if isinstance(shape_or_val, tuple):
-        return np.zeros(shape_or_val, dtype=NpFloat)
+        return np.zeros(shape_or_val, dtype=float_type())
     else:
-        return np.array(shape_or_val, dtype=NpFloat)
+        return np.array(shape_or_val, dtype=float_type())
 
 
 def int_masked_array(
@@ -6,6 +6,8 @@ import numpy.typing as npt
 # Unify numpy scalar types used across this project.
 NpFloat = np.float64
 NpInt = np.int32
+# Compact float type for stored model weights (e.g. pruned neighbor graphs).
+NpCompactFloat = np.float32
 
 # Readable aliases of Literal for annotated types.
 Shape = Literal
@@ -20,6 +22,8 @@ Represent = Literal
 # --- Basic Numpy Array Aliases ---
 _IntArray = npt.NDArray[NpInt]
 _FloatArray = npt.NDArray[NpFloat]
+_BoolArray = npt.NDArray[np.bool_]
+_CompactFloatArray = npt.NDArray[NpCompactFloat]
 _IntMaskedArray = Annotated[np.ma.MaskedArray[NpInt, np.dtype[np.int_]], NpInt]
 _FloatMaskedArray = Annotated[np.ma.MaskedArray[NpInt, np.dtype[np.int_]],
                               NpFloat]
@@ -28,11 +32,14 @@ _FloatMaskedArray = Annotated[np.ma.MaskedArray[NpInt, np.dtype[np.int_]],
 # 1-d Arrays
 IntArray = Annotated[_IntArray, Shape['_,']]
 FloatArray = Annotated[_FloatArray, Shape['_,']]
+BoolArray = Annotated[_BoolArray, Shape['_,']]
 IntMaskedArray = Annotated[_IntMaskedArray, Shape['_,']]
 FloatMaskedArray = Annotated[_FloatMaskedArray, Shape['_,']]
 
 # Matrices
 IntMatrix = Annotated[_IntArray, Shape['_, _']]
+BoolMatrix = Annotated[_BoolArray, Shape['_, _']]
+CompactFloatMatrix = Annotated[_CompactFloatArray, Shape['_, _']]
 FloatMatrix = Annotated[_FloatArray, Shape['_, _']]
 IntMaskedMatrix = Annotated[_IntMaskedArray, Shape['_, _']]
 FloatMaskedMatrix = Annotated[_FloatMaskedArray, Shape['_, _']]
@@ -45,6 +52,7 @@ EntryArray = Annotated[IntMatrix, Shape['_, 3'], Represent['Entry']]
 IndexedSimArray = Annotated[FloatMatrix, Shape['_, 2'], Represent['IndexedSim']]
 PredictionArray = Annotated[FloatArray, Represent['Prediction']]
 SupportMatrix = Annotated[FloatMatrix, Represent['Support']]
+NeighborTerms = tuple[FloatMatrix, FloatMatrix, FloatArray | float]
 
 # --- Function Types ---
 FSimilarity = Callable[[RatingMatrix, RatingMatrix], NanSimilarityMatrix]
@@ -53,3 +61,6 @@ FPrediction = Callable[
 FPreSortSim = Callable[[FloatArray], FloatArray]
 FIndexedSimMap = Callable[[IndexedSimArray], IndexedSimArray]
 FDynamicK = Callable[[IntMaskedArray], int]
+FNeighborTerms = Callable[
+    [IntMatrix, FloatMatrix, FloatMatrix, IntArray, RatingMatrix, FloatArray],
+    NeighborTerms]
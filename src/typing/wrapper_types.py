@@ -1,34 +1,199 @@
 from __future__ import annotations
 
+import hashlib
+import os
+from collections import ChainMap
 from functools import cached_property
-from typing import TYPE_CHECKING, overload
+from typing import TYPE_CHECKING, Any, Iterator, Mapping, TextIO, overload
 
 import numpy as np
 
 from ..utils import round_prediction
-from .nparray_builder import int_array
+from .nparray_builder import float_type, int_array
+from .type_aliases import NpCompactFloat, NpInt
 
 if TYPE_CHECKING:
     from .type_aliases import (
+        CompactFloatMatrix,
         EntryArray,
         FloatArray,
         FloatMatrix,
+        IndexedSimArray,
         IntArray,
+        IntMatrix,
         RatingMatrix,
     )
 
+# Questions formatted and written at a time by Questions.write_answers.
+ANSWER_CHUNK_SIZE = 1 << 14
+
 
 def IDIndexError(name: str, val: str = '', suffix: str = '') -> IndexError:
     return IndexError(f'{name}{val} out of range. {suffix}')
 
 
+def _is_index_array(key: Any) -> bool:
+    return not isinstance(key, (int, np.integer, slice))
+
+
+def _bool_index(key: Any) -> Any:
+    # A boolean mask indexes like the integer indices of its true entries.
+    if not isinstance(key, (list, np.ndarray)):
+        return key
+    mask = np.asarray(key)
+    if mask.dtype != np.bool_:
+        return key
+    if mask.ndim != 1:
+        raise TypeError('StackedMatrix only supports 1-d boolean indices.')
+    return np.flatnonzero(mask)
+
+
+class StackedMatrix():
+    '''
+    Read-only view of two masked matrices stacked by rows, as np.ma.vstack
+    would return, without copying them. Supports the indexing that predictors
+    use on rating matrices: a row, or a (rows, cols) pair of integers, slices,
+    integer arrays and 1-d boolean masks, where a pair of arrays indexes
+    element-wise.
+    '''
+
+    def __init__(self,
+                 top: RatingMatrix | StackedMatrix,
+                 bottom: RatingMatrix,
+                 transposed: bool = False) -> None:
+        self.top = top
+        self.bottom = bottom
+        self.dtype = top.dtype
+        self.ndim = 2
+        self._transposed = transposed
+        shape = (top.shape[0] + bottom.shape[0], top.shape[1])
+        self.shape = shape[::-1] if transposed else shape
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def T(self) -> StackedMatrix:
+        return StackedMatrix(self.top, self.bottom, not self._transposed)
+
+    def setflags(self, write: bool | None = None) -> None:
+        self.top.setflags(write=write)
+        self.bottom.setflags(write=write)
+
+    def __getitem__(self, key: Any) -> Any:
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        rows, cols = _bool_index(rows), _bool_index(cols)
+        if not self._transposed:
+            return self._take(rows, cols)
+
+        res = self._take(cols, rows)
+        if np.ndim(res) == 2 and not (_is_index_array(rows)
+                                      and _is_index_array(cols)):
+            res = res.T
+        return res
+
+    def _take(self, rows: Any, cols: Any) -> Any:
+        offset = self.top.shape[0]
+        n = offset + self.bottom.shape[0]
+
+        if isinstance(rows, (int, np.integer)):
+            row = int(rows) + n if rows < 0 else int(rows)
+            if row < offset:
+                return self.top[row, cols]
+            return self.bottom[row - offset, cols]
+
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(n)
+            if step == 1 and stop <= offset:
+                return self.top[start:stop, cols]
+            if step == 1 and start >= offset:
+                return self.bottom[start - offset:stop - offset, cols]
+            rows = np.arange(start, stop, step)
+            if _is_index_array(cols):
+                # A slice and an array index the outer product, not pairs.
+                rows = rows[:, None]
+
+        rows = np.asarray(rows)
+        rows = np.where(rows < 0, rows + n, rows)
+        in_top = rows < offset
+        if np.all(in_top):
+            return self.top[rows, cols]
+        if not np.any(in_top):
+            return self.bottom[rows - offset, cols]
+
+        if _is_index_array(cols):
+            rows, cols = np.broadcast_arrays(rows, np.asarray(cols))
+            in_top = rows < offset
+            shape = rows.shape
+            top_cols, bottom_cols = cols[in_top], cols[~in_top]
+        else:
+            n_cols = self.top.shape[1]
+            shape = rows.shape + ((len(range(
+                *cols.indices(n_cols))),) if isinstance(cols, slice) else ())
+            top_cols, bottom_cols = cols, cols
+
+        res = np.ma.masked_all(shape, dtype=self.dtype)
+        res[in_top] = self.top[rows[in_top], top_cols]
+        res[~in_top] = self.bottom[rows[~in_top] - offset, bottom_cols]
+        return res
+
+    def _sum_count(self, axis: int | None) -> tuple[Any, Any]:
+        '''
+        Sum (masked values as 0) and count of values of the untransposed stack
+        along axis 0 or all axes.
+        '''
+        total, count = 0, 0
+        for part in (self.top, self.bottom):
+            if isinstance(part, StackedMatrix):
+                part_total, part_count = part._sum_count(axis)
+            else:
+                part_total = np.ma.filled(np.ma.sum(part, axis=axis), 0)
+                part_count = np.ma.count(part, axis=axis)
+            total, count = total + part_total, count + part_count
+        return total, count
+
+    def mean(self, axis: int | None = None) -> Any:
+        if axis is not None and self._transposed:
+            axis = 1 - axis
+
+        if axis == 1:
+            return np.ma.concatenate(
+                (self.top.mean(axis=1), np.ma.mean(self.bottom, axis=1)))
+
+        total, count = self._sum_count(axis)
+        if axis is None:
+            return total / count if count else np.ma.masked
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.ma.masked_array(total / count, mask=count == 0)
+
+    def materialize(self) -> RatingMatrix:
+        '''
+        Copy of the stack as a masked matrix.
+        '''
+        top = self.top.materialize() if isinstance(self.top,
+                                                   StackedMatrix) else self.top
+        res = np.ma.vstack((top, self.bottom))
+        return res.T if self._transposed else res
+
+
 class UserItemRatings():
 
-    def __init__(self, raw_matrix: RatingMatrix, user_indices: dict[int, int]):
+    def __init__(self, raw_matrix: RatingMatrix | StackedMatrix,
+                 user_indices: Mapping[int, int]):
         self.raw = raw_matrix
         self.raw.setflags(write=False)
         self._user_indices = user_indices
 
+    @property
+    def user_ids(self) -> IntArray:
+        '''
+        User id of every row, e.g. to store the user id map in a model bundle.
+        '''
+        user_ids = int_array(len(self.raw))
+        for user_id, row in self._user_indices.items():
+            user_ids[row] = user_id
+        return user_ids
+
     @overload
     def ind_user_id(self, user_id: int) -> int:
         ...
@@ -90,21 +255,28 @@ class UserItemRatings():
                 col = self.ind_movie_id(col)
             return self.raw[row, col]
 
-    def __add__(self, other: UserItemRatings) -> UserItemRatings:
-        new_user_indices = {}
-        new_user_indices.update(self._user_indices)
-
-        # If any new users in other, append them to self.raw and update the
-        # user_indices dict.
+    def stack(self, other: UserItemRatings) -> UserItemRatings:
+        '''
+        Append the users of other that are not in self, without copying the
+        ratings of self. The result is backed by a StackedMatrix view; use
+        addition for a plain rating matrix.
+        '''
         offset = len(self.raw)
+        new_user_indices: dict[int, int] = {}
         rows_to_add: list[int] = []
         for user_id in other._user_indices:
-            if not user_id in new_user_indices:
+            if not user_id in self._user_indices:
                 new_user_indices[user_id] = len(rows_to_add) + offset
                 rows_to_add.append(other.ind_user_id(user_id))
 
-        return UserItemRatings(np.ma.vstack((self.raw, other.raw[rows_to_add])),
-                               new_user_indices)
+        return UserItemRatings(StackedMatrix(self.raw, other.raw[rows_to_add]),
+                               ChainMap(new_user_indices, self._user_indices))
+
+    def __add__(self, other: UserItemRatings) -> UserItemRatings:
+        stacked = self.stack(other)
+        return UserItemRatings(
+            stacked.raw.materialize(),    # type: ignore
+            dict(stacked._user_indices))
 
 
 class Questions():
@@ -114,8 +286,8 @@ class Questions():
         Extract questions from an entry array that contains question entries. 
         When there is no corresponding ground truth, answer shall be 0.
 
-        If contains_ans is true, all entries are regarded as questions. Otherwise,
-        only the entries with rating 0 are questions.
+        If contains_ans is true, all entries are regarded as questions.
+        Otherwise, only the entries with rating 0 are questions.
         '''
         self.raw: EntryArray
         self._answers: None | list[int] | IntArray
@@ -178,7 +350,8 @@ class Questions():
         self._contains_ans = True
 
         if (isinstance(answers, list) and isinstance(answers[0], float)) or \
-            (isinstance(answers, np.ndarray) and np.issubdtype(answers.dtype, np.floating)):
+            (isinstance(answers, np.ndarray) and
+             np.issubdtype(answers.dtype, np.floating)):
             # Force clamp rounding answers.
             answers = [round_prediction(ans) for ans in answers]
 
@@ -190,12 +363,44 @@ class Questions():
             answers, list) else answers.tolist()
         return self
 
+    def _answer_chunks(self, chunk_size: int) -> Iterator[str]:
+        '''
+        Lines of (user_id, movie_id, answer), formatted chunk_size rows at a
+        time. Rows without answers keep their rating.
+        '''
+        answers = self.raw[:, 2] if self._answers is None else self._answers
+        entries = np.column_stack((self.raw[:, :2], np.asarray(answers)))
+        for start in range(0, len(entries), chunk_size):
+            chunk = entries[start:start + chunk_size]
+            yield ('%d %d %d\n' * len(chunk)) % tuple(chunk.ravel().tolist())
+
+    def write_answers(self,
+                      path_or_file: str | os.PathLike | TextIO,
+                      chunk_size: int = ANSWER_CHUNK_SIZE) -> None:
+        '''
+        Write the questions with their answers, one 'user_id movie_id answer'
+        line per question, chunk_size lines at a time.
+        '''
+        if isinstance(path_or_file, (str, os.PathLike)):
+            with open(path_or_file, 'w') as f:
+                self.write_answers(f, chunk_size)
+            return
+
+        for chunk in self._answer_chunks(chunk_size):
+            path_or_file.write(chunk)
+
     def __str__(self) -> str:
-        res = ''
-        for i, (user_id, movie_id, rating) in enumerate(self.raw):
-            ans = self._answers[i] if self._answers is not None else rating
-            res += f'{user_id} {movie_id} {ans}\n'
-        return res
+        return ''.join(self._answer_chunks(ANSWER_CHUNK_SIZE))
+
+
+def matrix_digest(matrix: np.ndarray) -> str:
+    '''
+    Content digest of an array: its shape, dtype and raw buffer.
+    '''
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f'{matrix.shape}{matrix.dtype.str}'.encode())
+    hasher.update(np.ascontiguousarray(matrix).data)
+    return hasher.hexdigest()
 
 
 class HashableMatrix():
@@ -208,17 +413,49 @@ class HashableMatrix():
         self.raw.setflags(write=False)
 
     @cached_property
-    def _hash(self) -> int:
+    def digest(self) -> str:
         '''
-        Hash the float matrix with str conversion.
-        We don't provide a perfect hash for the float matrix, since it is rarely
-        needed under our context.
+        Content digest of the matrix (shape, dtype and raw buffer). The matrix
+        is read-only, so the digest stays valid for the lifetime of the wrapper.
         '''
-        return hash(str(self.raw))
+        return matrix_digest(self.raw)
 
     def __hash__(self) -> int:
-        return self._hash
+        return hash(self.digest)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, HashableMatrix):
+            return NotImplemented
+        return self is other or self.digest == other.digest
 
 
 Similarity = HashableMatrix
 Support = HashableMatrix
+
+
+class NeighborGraph():
+    '''
+    Pruned similarity matrix (KNN graph) that keeps only the top neighbors of
+    every row, in descending order, as parallel arrays of neighbor indices
+    (padded with -1) and similarities (padded with 0).
+    '''
+
+    def __init__(self, neighbors: IntMatrix,
+                 weights: CompactFloatMatrix) -> None:
+        self.neighbors = neighbors.astype(NpInt, copy=False)
+        self.weights = weights.astype(NpCompactFloat, copy=False)
+        self.neighbors.setflags(write=False)
+        self.weights.setflags(write=False)
+
+    @property
+    def nbytes(self) -> int:
+        return self.neighbors.nbytes + self.weights.nbytes
+
+    def indexed(self, row: int) -> IndexedSimArray:
+        '''
+        Neighbors of a row in the indexed similarity array format.
+        '''
+        neighbors = self.neighbors[row]
+        valid = neighbors >= 0
+        return np.column_stack(
+            (neighbors[valid], self.weights[row][valid])).astype(float_type())
@@ -1,3 +1,13 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .typing import FloatArray, IntArray
+
+
 def round_prediction(prediction: float) -> int:
     '''
     Round and clamp the prediction.
@@ -8,3 +18,11 @@ def round_prediction(prediction: float) -> int:
     elif rounded > 5:
         return 5
     return rounded
+
+
+def round_predictions(predictions: FloatArray) -> IntArray:
+    '''
+    Round and clamp an array of predictions, as round_prediction does (both
+    round half to even).
+    '''
+    return np.clip(np.round(predictions), 1, 5).astype(np.int32)
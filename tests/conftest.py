@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pytest
+
+from src.io import aggregate_cross_validation
+from src.io.synthetic import SyntheticRatings
+
+if TYPE_CHECKING:
+    from src.typing import Questions, UserItemRatings
+
+
+@pytest.fixture(scope='session')
+def synthetic_raq() -> tuple[UserItemRatings, UserItemRatings, Questions]:
+    '''
+    Cross-validation split of sparse synthetic ratings of 1 to 5, where many
+    similarities are exactly tied.
+    '''
+    entries = np.random.default_rng(0).permutation(
+        SyntheticRatings(200, 500, 0.05).entries())
+    bound = len(entries) // 10
+    train, test = entries[bound:], entries[:bound]
+    return aggregate_cross_validation(train,
+                                      test[np.isin(test[:, 0], train[:, 0])])
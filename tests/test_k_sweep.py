@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import pytest
+
+from src.core.cf import knn_graph, similarity_matrix
+from src.predictors import item_based_cf, user_based_cf
+from src.presets import presets
+
+if TYPE_CHECKING:
+    from src.config import Config
+
+K_RANGE = np.arange(1, 31)
+
+_user_confs = {'cos': presets['cos'], 'corr': presets['corr']}
+
+
+def _assert_sweep_matches(raq: tuple, predictor: Any, conf: Config,
+                          **kwargs: Any) -> None:
+    sweep = predictor(*raq, conf, k_range=K_RANGE, **kwargs)
+    for k, predictions in zip(K_RANGE, sweep):
+        expected = predictor(*raq, conf + {'knn_k': int(k)}, **kwargs)
+        np.testing.assert_allclose(predictions, expected, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('name', _user_confs)
+def test_user_based_sweep_matches_every_k(synthetic_raq: tuple,
+                                          name: str) -> None:
+    r, a, _ = synthetic_raq
+    conf = _user_confs[name]
+    similarity = similarity_matrix(a.raw, r.raw, conf.sim_scheme,
+                                   conf.sim_fill_value)
+    sort_sim = np.abs(similarity.raw) if conf.pre_sort_sim else similarity.raw
+    # The data must have ties for the test to cover them.
+    assert any(len(np.unique(row)) < len(row) // 2 for row in sort_sim)
+    _assert_sweep_matches(synthetic_raq,
+                          user_based_cf,
+                          conf,
+                          user_similarity=similarity)
+
+
+@pytest.mark.parametrize('name', _user_confs)
+def test_user_graph_sweep_matches_every_k(synthetic_raq: tuple,
+                                          name: str) -> None:
+    r, a, _ = synthetic_raq
+    conf = _user_confs[name]
+    graph = knn_graph(a.raw,
+                      r.raw,
+                      conf.sim_scheme,
+                      conf.sim_fill_value,
+                      int(K_RANGE[-1]),
+                      pre_sort_sim=conf.pre_sort_sim)
+    _assert_sweep_matches(synthetic_raq, user_based_cf, conf, user_graph=graph)
+
+
+def test_item_based_sweep_matches_every_k(synthetic_raq: tuple) -> None:
+    r, _, _ = synthetic_raq
+    conf = presets['adj_cos']
+    similarity = similarity_matrix(r.raw.T, r.raw.T, conf.sim_scheme,
+                                   conf.sim_fill_value)
+    _assert_sweep_matches(synthetic_raq,
+                          item_based_cf,
+                          conf,
+                          item_similarity=similarity)
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import numpy as np
+
+from src.core.cf.similarity_selection import (
+    indexed_desc_similarity,
+    prune_neighbors,
+    top_k_rated_neighbors,
+)
+from src.typing import Similarity
+
+
+def _tied_similarity() -> Similarity:
+    # Few distinct values, so that every row has exact ties.
+    rng = np.random.default_rng(0)
+    return Similarity(rng.integers(-2, 3, (6, 40)).astype(np.float64) / 2)
+
+
+def _desc_order(values: np.ndarray) -> np.ndarray:
+    # Descending values, ties by ascending index.
+    return np.lexsort((np.arange(len(values)), -values))
+
+
+def test_indexed_desc_similarity_breaks_ties_by_index() -> None:
+    similarity = _tied_similarity()
+    for row in range(similarity.raw.shape[0]):
+        desc_sim = indexed_desc_similarity(row, similarity)
+        np.testing.assert_array_equal(desc_sim[:, 0],
+                                      _desc_order(similarity.raw[row]))
+
+
+def test_top_k_rated_neighbors_is_prefix_of_full_order() -> None:
+    similarity = _tied_similarity()
+    rated_rows = np.arange(0, 40, 3)
+    for row in range(similarity.raw.shape[0]):
+        values = similarity.raw[row, rated_rows]
+        expected = rated_rows[_desc_order(values)]
+        for k in range(len(rated_rows) + 1):
+            rows, sims = top_k_rated_neighbors(row, rated_rows, k, similarity)
+            np.testing.assert_array_equal(rows, expected[:k])
+            np.testing.assert_array_equal(sims, similarity.raw[row, rows])
+        rows, _ = top_k_rated_neighbors(row, rated_rows, -1, similarity)
+        np.testing.assert_array_equal(rows, expected)
+
+
+def test_prune_neighbors_is_prefix_of_full_order() -> None:
+    sim_m = _tied_similarity().raw
+    for m in range(sim_m.shape[1] + 1):
+        neighbors, sims = prune_neighbors(sim_m, m)
+        for row in range(sim_m.shape[0]):
+            expected = _desc_order(sim_m[row])[:m]
+            np.testing.assert_array_equal(neighbors[row], expected)
+            np.testing.assert_array_equal(sims[row], sim_m[row, expected])
+
+
+def test_prune_neighbors_drops_self_and_below_threshold() -> None:
+    sim_m = _tied_similarity().raw[:, :6]
+    neighbors, sims = prune_neighbors(sim_m, 6, threshold=0, self_offset=0)
+    for row in range(sim_m.shape[0]):
+        values = sim_m[row].copy()
+        values[row] = -np.inf
+        expected = [i for i in _desc_order(values) if values[i] >= 0]
+        kept = neighbors[row] >= 0
+        np.testing.assert_array_equal(neighbors[row][kept], expected)
+        assert not sims[row][~kept].any()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable
+
+import numpy as np
+import pytest
+
+from src.loss import loss_mae
+from src.predictors import user_based_cf
+from src.presets import dynamic_presets, presets
+from src.typing import precision
+from src.utils import round_predictions
+from src.variants import vanilla_variants
+
+if TYPE_CHECKING:
+    from src.config import Config
+    from src.typing import RatingMatrix
+
+# Predictions in float32 agree with float64 to about 1e-6 before rounding,
+# except where float32 reorders (nearly) tied similarities and so changes the
+# top k neighbors. User-based CF then moves a few percent of its predictions by
+# up to a rating (4.6% of uvi5 with cos and k = 10), and its MAE by up to
+# FLOAT32_MAE_TOLERANCE.
+FLOAT32_ATOL = 1e-5
+FLOAT32_MOVED_SHARE = 0.05
+FLOAT32_MAE_TOLERANCE = 0.01
+
+_user_confs: dict[str, Callable[[RatingMatrix], Config]] = {
+    'cos':
+        lambda r: presets['cos'] + {
+            'knn_k': 10
+        },
+    'corr':
+        lambda r: presets['corr'] + {
+            'knn_k': 20
+        },
+    'corr_iuf':
+        lambda r: presets['corr'] + dynamic_presets['iuf'](r) + {
+            'knn_k': 20
+        },
+}
+
+
+def _assert_float32_matches(raq: tuple, predictor: Any, conf: Config) -> None:
+    predictions = {}
+    for dtype in (np.float64, np.float32):
+        with precision(dtype):
+            predictions[dtype] = np.asarray(predictor(*raq, conf),
+                                            dtype=np.float64)
+
+    moved = ~np.isclose(predictions[np.float32],
+                        predictions[np.float64],
+                        rtol=0,
+                        atol=FLOAT32_ATOL)
+    assert moved.mean() <= FLOAT32_MOVED_SHARE
+
+    ground_truth = raq[2].ground_truth()
+    mae64, mae32 = (loss_mae(ground_truth, round_predictions(predictions[t]))
+                    for t in (np.float64, np.float32))
+    assert abs(mae32 - mae64) <= FLOAT32_MAE_TOLERANCE
+
+
+@pytest.mark.parametrize('i', range(len(vanilla_variants)))
+def test_float32_vanilla_variants(synthetic_raq: tuple, i: int) -> None:
+    variant = vanilla_variants[i]
+    _assert_float32_matches(synthetic_raq, variant['predictor'],
+                            variant['conf'])
+
+
+@pytest.mark.parametrize('name', _user_confs)
+def test_float32_user_based(synthetic_raq: tuple, name: str) -> None:
+    r, _, _ = synthetic_raq
+    _assert_float32_matches(synthetic_raq, user_based_cf,
+                            _user_confs[name](r.raw))
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+import pytest
+
+from src.core.cf import similarity_matrix
+from src.core.cf.funcs.similarity_func import (
+    adjusted_cosine_similarity,
+    average_difference_matrix,
+    cosine_similarity,
+    pearson_correlation,
+)
+from src.core.cf.similarity import BLOCK_ULPS, parallel_similarity_matrix
+from src.io.data_agg import aggregate_ratings
+from src.io.synthetic import SyntheticRatings
+from src.presets import dynamic_presets
+from src.typing import precision
+
+_similarity_funcs = {
+    'cos': cosine_similarity,
+    'corr': pearson_correlation,
+    'adj_cos': adjusted_cosine_similarity,
+    'slope_one': average_difference_matrix,
+}
+
+
+def _cases() -> list[Any]:
+    # User and item similarities of small synthetic ratings, with and without
+    # IUF weights.
+    r = aggregate_ratings(SyntheticRatings(40, 100, 0.1).entries()).raw
+    cases = []
+    for name, func in _similarity_funcs.items():
+        for item_based in (False, True):
+            if func is adjusted_cosine_similarity and not item_based:
+                continue
+            rows = r.T if item_based else r
+            weights = dynamic_presets['iuf'](r, item_based).sim_weights
+            kind = 'item' if item_based else 'user'
+            cases.append(pytest.param(rows, func, None, id=f'{kind}-{name}'))
+            cases.append(
+                pytest.param(rows, func, weights, id=f'{kind}-{name}-iuf'))
+    return cases
+
+
+def _assert_block_close(actual: np.ndarray, expected: np.ndarray) -> None:
+    eps = np.finfo(expected.dtype).eps
+    atol = BLOCK_ULPS * eps * max(1, np.max(np.abs(expected)))
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=atol)
+
+
+@pytest.mark.parametrize('dtype', (np.float64, np.float32))
+@pytest.mark.parametrize('rows, func, weights', _cases())
+def test_tiled_matches_untiled(rows: np.ma.MaskedArray, func: Any, weights: Any,
+                               dtype: Any) -> None:
+    with precision(dtype):
+        expected = similarity_matrix(rows, rows, func, 0, weights).raw
+        for max_bytes in (4096, 65536):
+            tiled = similarity_matrix(rows,
+                                      rows,
+                                      func,
+                                      0,
+                                      weights,
+                                      max_bytes=max_bytes).raw
+            assert tiled.dtype == expected.dtype
+            _assert_block_close(tiled, expected)
+
+
+@pytest.mark.parametrize('dtype', (np.float64, np.float32))
+@pytest.mark.parametrize('rows, func, weights', _cases())
+def test_parallel_matches_serial(rows: np.ma.MaskedArray, func: Any,
+                                 weights: Any, dtype: Any) -> None:
+    with precision(dtype):
+        expected = similarity_matrix(rows, rows, func, 0, weights).raw
+        for workers, max_bytes in ((1, None), (3, None), (3, 65536)):
+            parallel = parallel_similarity_matrix(rows,
+                                                  rows,
+                                                  func,
+                                                  0,
+                                                  weights,
+                                                  workers=workers,
+                                                  max_bytes=max_bytes).raw
+            assert parallel.dtype == expected.dtype
+            _assert_block_close(parallel, expected)
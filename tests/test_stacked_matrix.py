@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+import pytest
+
+from src.typing import StackedMatrix
+
+
+def _ratings(rng: np.random.Generator, n: int, k: int) -> np.ma.MaskedArray:
+    data = rng.integers(1, 6, (n, k)).astype(np.int32)
+    return np.ma.masked_array(data, mask=rng.random((n, k)) < 0.6)
+
+
+def _stacks() -> list[tuple[str, StackedMatrix, np.ma.MaskedArray]]:
+    rng = np.random.default_rng(0)
+    top, middle, bottom = [_ratings(rng, n, 5) for n in (7, 3, 2)]
+    stack = StackedMatrix(StackedMatrix(top, middle), bottom)
+    full = np.ma.vstack((top, middle, bottom))
+    return [('stacked', stack, full), ('transposed', stack.T, full.T)]
+
+
+def _keys(shape: tuple[int, int]) -> list[Any]:
+    n_rows, n_cols = shape
+    rng = np.random.default_rng(1)
+    rows = rng.integers(0, n_rows, 4)
+    cols = rng.integers(0, n_cols, 4)
+    row_mask = rng.random(n_rows) < 0.5
+    row_grid = rows.reshape(2, 2)
+    ints = [0, n_rows - 1, -1, -n_rows]
+    slices = [
+        slice(None),
+        slice(1, n_rows - 1),
+        slice(None, None, 2),
+        slice(None, None, -1)
+    ]
+    arrays = [rows, -rows - 1, [0, n_rows - 1], row_mask, list(row_mask)]
+    pairs = [(2, 3), (-1, -1), (2, slice(1, None)), (slice(None), 1),
+             (slice(2, n_rows), cols[0]), (rows, 0), (rows, slice(None, 3)),
+             (rows, cols), (rows[:, None], cols), (row_grid, cols[:2]),
+             (slice(1, None), cols), (row_mask, 1), (row_mask, cols[:1]),
+             (0, np.arange(n_cols) % 2 == 0)]
+    return ints + slices + arrays + pairs
+
+
+def _assert_same(actual: Any, expected: Any) -> None:
+    if expected is np.ma.masked:
+        assert actual is np.ma.masked
+        return
+    actual, expected = np.ma.asarray(actual), np.ma.asarray(expected)
+    assert actual.shape == expected.shape
+    np.testing.assert_array_equal(np.ma.getmaskarray(actual),
+                                  np.ma.getmaskarray(expected))
+    np.testing.assert_array_equal(actual.filled(0), expected.filled(0))
+
+
+@pytest.mark.parametrize('name, stack, full', _stacks())
+def test_indexing_matches_vstack(name: str, stack: StackedMatrix,
+                                 full: np.ma.MaskedArray) -> None:
+    assert stack.shape == full.shape
+    for key in _keys(full.shape):
+        _assert_same(stack[key], full[key])
+
+
+@pytest.mark.parametrize('name, stack, full', _stacks())
+def test_elements_match_vstack(name: str, stack: StackedMatrix,
+                               full: np.ma.MaskedArray) -> None:
+    for i in range(full.shape[0]):
+        for j in range(full.shape[1]):
+            _assert_same(stack[i, j], full[i, j])
+
+
+@pytest.mark.parametrize('name, stack, full', _stacks())
+def test_mean_matches_vstack(name: str, stack: StackedMatrix,
+                             full: np.ma.MaskedArray) -> None:
+    for axis in (0, 1):
+        expected = full.mean(axis=axis)
+        actual = stack.mean(axis=axis)
+        np.testing.assert_array_equal(np.ma.getmaskarray(actual),
+                                      np.ma.getmaskarray(expected))
+        np.testing.assert_allclose(actual.filled(0), expected.filled(0))
+    assert np.isclose(stack.mean(), full.mean())
+
+
+@pytest.mark.parametrize('name, stack, full', _stacks())
+def test_materialize_matches_vstack(name: str, stack: StackedMatrix,
+                                    full: np.ma.MaskedArray) -> None:
+    _assert_same(stack.materialize(), full)
+
+
+def test_rejects_2d_boolean_index() -> None:
+    _, stack, full = _stacks()[0]
+    with pytest.raises(TypeError):
+        stack[np.ones(full.shape, dtype=bool)]